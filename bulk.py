@@ -0,0 +1,206 @@
+import csv
+import json
+import os
+import re
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+from classes import AddressBook, Record, Name, Phone, Email, BirthDay, Status, Note
+from exceptions_address_book import PhoneExistException, PhoneNumberNotFilledException
+from validators import validate_many
+
+PHONE_SEPARATOR = ';'
+VCARD_UNESCAPED = {'n': '\n', 'N': '\n'}
+VCARD_ESCAPE = re.compile(r'\\(.)')
+VCARD_FIELDS = {'FN': 'name', 'TEL': 'phone', 'EMAIL': 'email', 'BDAY': 'bd', 'CATEGORIES': 'status', 'NOTE': 'note'}
+
+
+def _local_number(number: str) -> str:
+    # numbers are stored as +38<operator code>..., but the validator expects them without the country code
+    number = number.strip()
+    for prefix in ('+38', '38'):
+        if number.startswith(prefix + '0'):
+            return number[len(prefix):]
+    return number
+
+
+def _phones(value: str | list | None) -> List[str]:
+    if not value:
+        return []
+    numbers: list = value if isinstance(value, list) else value.split(PHONE_SEPARATOR)
+    return [_local_number(number) for number in numbers if number.strip()]
+
+
+def _phone_numbers(checked: List[tuple]) -> List[str]:
+    # the rules of Phone(first number) followed by set_value() for every other one
+    numbers: list = []
+    for position, (number, error) in enumerate(checked):
+        if error is not None:
+            raise error
+        if number is None:
+            if position:
+                raise PhoneNumberNotFilledException
+        elif number in numbers:
+            raise PhoneExistException(number)
+        else:
+            numbers.append(number)
+    return numbers
+
+
+def make_records(rows: List[Dict[str, str | list | None]]) -> List[Record | Exception]:
+    # a batch is validated one column at a time and the fields are restored from the checked values;
+    # a row that fails gets its first error in place of a record
+    phones: list = [_phones(row.get('phone')) for row in rows]
+    checked_phones: Iterator[tuple] = iter(validate_many('phone', [number for numbers in phones for number in numbers]))
+    columns: list = [validate_many(field_name, values) for field_name, values in (
+        ('name', [(row.get('name') or '').strip() for row in rows]),
+        ('email', [row.get('email') or None for row in rows]),
+        ('bd', [row.get('bd') or None for row in rows]),
+        ('status', [row.get('status') or None for row in rows]))]
+    res: list = []
+    for row, numbers, *checked in zip(rows, phones, *columns):
+        try:
+            phone: Phone = Phone.restore(_phone_numbers(list(islice(checked_phones, len(numbers)))))
+            values: list = []
+            for value, error in checked:
+                if error is not None:
+                    raise error
+                values.append(value)
+            name, email, birthday, status = values
+            res.append(Record(Name.restore(name), phone, Email.restore(email), BirthDay.restore(birthday),
+                              Status.restore(status), Note.restore(row.get('note') or None)))
+        except Exception as error:
+            res.append(error)
+    return res
+
+
+def record_to_row(record: Record) -> Dict[str, str | None]:
+    birthday = record.bd.get_value()
+    return {'name': record.name.get_value(),
+            'phone': PHONE_SEPARATOR.join(record.phone.get_value()),
+            'email': record.email.get_value(),
+            'bd': birthday.isoformat() if birthday else None,
+            'status': record.status.get_value(),
+            'note': record.note.get_value()}
+
+
+def read_csv(path: str) -> Iterator[dict]:
+    with open(path, newline='', encoding='utf-8') as fr:
+        yield from csv.DictReader(fr)
+
+
+def read_json(path: str) -> Iterator[dict]:
+    with open(path, encoding='utf-8') as fr:
+        for line in fr:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _vcard_unescape(value: str) -> str:
+    # one pass, so an escaped backslash before 'n' is not read as a newline; other escapes give the char itself
+    return VCARD_ESCAPE.sub(lambda match: VCARD_UNESCAPED.get(match.group(1), match.group(1)), value)
+
+
+def _vcard_escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace(',', '\\,').replace(';', '\\;')
+
+
+def _unfolded(lines: Iterable[str]) -> Iterator[str]:
+    current: str | None = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current is not None:
+        yield current
+
+
+def read_vcard(path: str) -> Iterator[dict]:
+    with open(path, encoding='utf-8') as fr:
+        row: dict = {}
+        for line in _unfolded(fr):
+            key, _, value = line.partition(':')
+            key = key.split(';', 1)[0].upper()
+            if key == 'BEGIN':
+                row = {}
+            elif key == 'END':
+                yield row
+            elif key == 'TEL':
+                row.setdefault('phone', []).append(value)
+            elif key in VCARD_FIELDS:
+                row[VCARD_FIELDS[key]] = _vcard_unescape(value)
+
+
+def write_csv(records: Iterable[Record], path: str) -> None:
+    with open(path, 'w', newline='', encoding='utf-8') as fw:
+        writer = csv.DictWriter(fw, fieldnames=Record.fields)
+        writer.writeheader()
+        for record in records:
+            writer.writerow(record_to_row(record))
+
+
+def write_json(records: Iterable[Record], path: str) -> None:
+    with open(path, 'w', encoding='utf-8') as fw:
+        for record in records:
+            fw.write(json.dumps(record_to_row(record), ensure_ascii=False) + '\n')
+
+
+def write_vcard(records: Iterable[Record], path: str) -> None:
+    with open(path, 'w', encoding='utf-8') as fw:
+        for record in records:
+            row: dict = record_to_row(record)
+            lines: list = ['BEGIN:VCARD', 'VERSION:3.0', f'FN:{_vcard_escape(row["name"])}']
+            lines += [f'TEL:{number}' for number in record.phone.get_value()]
+            for key, field_name in VCARD_FIELDS.items():
+                if key not in ('FN', 'TEL') and row[field_name]:
+                    lines.append(f'{key}:{_vcard_escape(row[field_name])}')
+            lines.append('END:VCARD')
+            fw.write('\r\n'.join(lines) + '\r\n')
+
+
+READERS: Dict[str, Callable] = {'.csv': read_csv, '.json': read_json, '.jsonl': read_json, '.vcf': read_vcard}
+WRITERS: Dict[str, Callable] = {'.csv': write_csv, '.json': write_json, '.jsonl': write_json, '.vcf': write_vcard}
+
+
+def _format(path: str, formats: dict) -> Callable:
+    extension: str = os.path.splitext(path)[1].lower()
+    if extension not in formats:
+        raise ValueError(f'Unsupported file format {extension}, use one of: {", ".join(formats)}')
+    return formats[extension]
+
+
+def import_rows(rows: Iterable[dict], book: AddressBook, batch_size: int = 1000) -> Tuple[int, List[tuple]]:
+    imported: int = 0
+    errors: list = []
+    numbered_rows: Iterator[tuple] = enumerate(rows, start=1)
+    while True:
+        batch: list = list(islice(numbered_rows, batch_size))
+        if not batch:
+            break
+        records: list = []
+        for (line, _), record in zip(batch, make_records([row for _, row in batch])):
+            if isinstance(record, Exception):
+                errors.append((line, record))
+            else:
+                records.append((line, record))
+        for line, record in records:
+            try:
+                book.add_record(record)
+                imported += 1
+            except Exception as error:
+                errors.append((line, error))
+    return imported, errors
+
+
+def import_contacts(path: str, book: AddressBook, batch_size: int = 1000) -> Tuple[int, List[tuple]]:
+    return import_rows(_format(path, READERS)(path), book, batch_size)
+
+
+def export_contacts(book: AddressBook, path: str, page: int = 1000) -> int:
+    writer: Callable = _format(path, WRITERS)
+    writer((record for records in book.iterator(page) for record in records), path)
+    return len(book)
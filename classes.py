@@ -1,12 +1,15 @@
 from collections import UserDict
+from contextlib import contextmanager
 import re
+import threading
 from abc import ABC, abstractmethod
 import datetime
-from typing import Any, List
+from types import MemberDescriptorType
+from typing import Any, Iterator, List, Set
 from exceptions_address_book import *
-
-UKR_MOBILE_PHONE_CODES = ['095', '099', '050', '063', '066', '067', '077', '0800', '045', '046', '032',
-                          '044', '048', '068', '097', '098', '091', '092', '094', ]
+from indexes import RecordIndex, KeywordIndex, NameIndex, BirthdayIndex, PhoneIndex, FacetIndex, FuzzyNameIndex, \
+    next_birthday, email_domain, birth_month, required_literals
+from validators import check_name, check_phone, check_email, check_birthday, check_status, STATUSES
 
 
 class TerminalPrint(ABC):
@@ -15,7 +18,45 @@ class TerminalPrint(ABC):
         raise NotImplementedError
 
 
-class Field(ABC):
+class Observable:
+    # a field keeps the record that owns it rather than a bound method, which would cost an object per field
+    __slots__ = ('_record',)
+
+    def _notify(self, old_value: Any) -> None:
+        record: Record | None = getattr(self, '_record', None)
+        if record is not None:
+            record._field_changed(self, old_value)
+
+    def __getstate__(self) -> dict:
+        state: tuple | None = super().__getstate__()
+        slots: dict = dict(state[1]) if state else {}
+        slots.pop('_record', None)
+        return slots
+
+    def __setstate__(self, state: dict) -> None:
+        # pickles written before fields had __slots__ carry a plain __dict__ (with e.g. Status.statuses)
+        for key, value in state.items():
+            if isinstance(getattr(type(self), key, None), MemberDescriptorType):
+                setattr(self, key, value)
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        slots: tuple = cls.__dict__.get('__slots__', ())
+        if slots:
+            # the descriptor of the slot that holds the value, looked up once instead of on every restore
+            cls._value_slot = cls.__dict__[f'_{cls.__name__}{slots[0]}' if slots[0].startswith('__') else slots[0]]
+
+    @classmethod
+    def restore(cls, value: Any) -> 'Observable':
+        # rebuilds a field from a value that was validated before it was stored
+        field: Observable = cls.__new__(cls)
+        cls._value_slot.__set__(field, value)
+        return field
+
+
+class Field(Observable, ABC):
+    __slots__ = ()
+
     @abstractmethod
     def get_value(self):
         raise NotImplementedError
@@ -29,11 +70,16 @@ class Field(ABC):
         raise NotImplementedError
 
     @abstractmethod
-    def display(self, output: TerminalPrint) -> None:
+    def render(self) -> str:
         raise NotImplementedError
 
+    def display(self, output: TerminalPrint) -> None:
+        output.display(self.render())
+
+
+class UnnecessaryField(Observable, ABC):
+    __slots__ = ()
 
-class UnnecessaryField(ABC):
     @abstractmethod
     def get_value(self):
         raise NotImplementedError
@@ -43,15 +89,42 @@ class UnnecessaryField(ABC):
         raise NotImplementedError
 
     @abstractmethod
-    def display(self, output: TerminalPrint) -> None:
+    def render(self) -> str:
         raise NotImplementedError
 
+    def display(self, output: TerminalPrint) -> None:
+        output.display(self.render())
+
 
 class Output(TerminalPrint):
     def display(self, text: str) -> None:
         print(text)
 
 
+class BufferedOutput(TerminalPrint):
+    # collects lines and hands them to the wrapped output as one block on flush() or every `size` lines
+    def __init__(self, output: TerminalPrint = None, size: int = 1000) -> None:
+        self.output = output or Output()
+        self.size = size
+        self._lines: list = []
+
+    def display(self, text: str) -> None:
+        self._lines.append(text)
+        if len(self._lines) >= self.size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._lines:
+            text, self._lines = '\n'.join(self._lines), []
+            self.output.display(text)
+
+    def __enter__(self) -> 'BufferedOutput':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.flush()
+
+
 class View(ABC):
     @abstractmethod
     def add_command(self, command):
@@ -74,6 +147,8 @@ class TerminalView(View):
 
 
 class Name(Field):
+    __slots__ = ('__name',)
+
     def __init__(self, name: str):
         _name = self._check_value(name)
         if _name:
@@ -85,19 +160,20 @@ class Name(Field):
     def set_value(self, newname: str) -> None:
         _value = self._check_value(newname)
         if _value:
+            old_value: str = self.__name
             self.__name = _value
+            self._notify(old_value)
 
     def _check_value(self, name: str) -> str | Exception:
-        if name and isinstance(name, str) and len(name) > 1:
-            return name
-        else:
-            raise NameNotFilledException
+        return check_name(name)
 
-    def display(self, output: TerminalPrint) -> None:
-        output.display(f'Name: {self.__name}')
+    def render(self) -> str:
+        return f'Name: {self.__name}'
 
 
 class Phone(Field):
+    __slots__ = ('__phone_number',)
+
     def __init__(self, phone_number: str) -> None:
         self.__phone_number = []
         _value = self._check_value(phone_number)
@@ -108,20 +184,14 @@ class Phone(Field):
         return self.__phone_number
 
     def _check_value(self, phone_num: str) -> str | None:
-        if phone_num:
-            phone_num = re.sub(r'[+\-() ]', '', phone_num)
-            if re.fullmatch(r'^([0-9]){6,14}[0-9]$', phone_num):
-                for inner_code in UKR_MOBILE_PHONE_CODES:
-                    if phone_num.startswith(inner_code):
-                        return f'+38{phone_num}'
-            else:
-                raise ValidPhoneException(phone_num)
-        return None
+        return check_phone(phone_num)
 
     def set_value(self, phone_number: str) -> None:
         _number = self._check_value(phone_number)
         if _number and _number not in self.__phone_number:
+            old_value: list = self.__phone_number.copy()
             self.__phone_number.append(_number)
+            self._notify(old_value)
         elif not _number:
             raise PhoneNumberNotFilledException
         else:
@@ -130,14 +200,19 @@ class Phone(Field):
     def delete_phone_number(self, phone_number: str) -> None:
         number_find = [num for num in self.__phone_number if re.search(phone_number, num)]
         if number_find:
+            old_value: list = self.__phone_number.copy()
             self.__phone_number.remove(*number_find)
+            self._notify(old_value)
+            return
         raise PhoneNotExistException(phone_number)
 
-    def display(self, output: TerminalPrint) -> None:
-        output.display(f'Phone number(-s): {self.__phone_number}')
+    def render(self) -> str:
+        return f'Phone number(-s): {self.__phone_number}'
 
 
 class Email(Field):
+    __slots__ = ('__email',)
+
     def __init__(self, email: str = None) -> None:
         _value = self._check_value(email)
         self.__email = _value
@@ -146,21 +221,20 @@ class Email(Field):
         return self.__email
 
     def set_value(self, new_email: str) -> None:
+        old_value: str = self.__email
         self.__email = self._check_value(new_email)
+        self._notify(old_value)
 
     def _check_value(self, email: str) -> str | None:
-        if email and re.match(r"([a-zA-Z.]+\w+\.?)+(@\w{2,}\.)(\w{2,})", email):
-            return email
-        elif not email:
-            return None
-        else:
-            raise ValidEmailException(email)
+        return check_email(email)
 
-    def display(self, output: TerminalPrint) -> None:
-        output.display(f'Email: {self.__email}')
+    def render(self) -> str:
+        return f'Email: {self.__email}'
 
 
 class BirthDay(Field):
+    __slots__ = ('__birth_date',)
+
     def __init__(self, birth_date: str = None):
         _value = self._check_value(birth_date)
         self.__birth_date = _value
@@ -169,41 +243,29 @@ class BirthDay(Field):
         return self.__birth_date
 
     def set_value(self, birth_date_: str) -> None:
+        old_value: datetime.date = self.__birth_date
         self.__birth_date = self._check_value(birth_date_)
+        self._notify(old_value)
 
     def _check_value(self, birthday: str) -> datetime.date | None | Exception:
-        if birthday:
-            try:
-                year, month, day = birthday.strip().split('-')
-            except ValueError:
-                raise ValidBirthDateException(birthday)
-            try:
-                return datetime.date(int(year), int(month), int(day))
-            except ValueError:
-                raise ValidBirthDateFormatException(birthday)
-        else:
-            return None
+        return check_birthday(birthday)
 
     def days_to_birthday(self) -> int:
         if self.__birth_date:
             current_date: datetime.date = datetime.date.today()
-            birthday: datetime.date = datetime.date(year=current_date.year, month=self.__birth_date.month,
-                                                    day=self.__birth_date.day)
-            diff: int = (birthday - current_date).days
-            if diff < 0:
-                birthday: datetime.date = datetime.date(year=current_date.year + 1, month=self.__birth_date.month,
-                                                        day=self.__birth_date.day)
-                diff = (birthday - current_date).days
-            return diff
+            birthday: datetime.date = next_birthday(self.__birth_date.month, self.__birth_date.day, current_date)
+            return (birthday - current_date).days
         raise BirthdayNotExistException
 
-    def display(self, output: TerminalPrint) -> None:
-        output.display(f'Birthday: {self.__birth_date.strftime("%A %d %B %Y") if self.__birth_date else None}')
+    def render(self) -> str:
+        return f'Birthday: {self.__birth_date.strftime("%A %d %B %Y") if self.__birth_date else None}'
 
 
 class Status(Field):
+    __slots__ = ('__status',)
+    statuses = STATUSES
+
     def __init__(self, status: str = None):
-        self.statuses = ['Friend', 'Family', 'Co-Worker', 'Special', None]
         _status = self._check_value(status)
         self.__status = _status
 
@@ -211,18 +273,20 @@ class Status(Field):
         return self.__status
 
     def set_value(self, new_status: str) -> None:
+        old_value: str = self.__status
         self.__status = self._check_value(new_status)
+        self._notify(old_value)
 
     def _check_value(self, status: str) -> str:
-        if status in self.statuses:
-            return status
-        raise StatusNotExistException(status)
+        return check_status(status)
 
-    def display(self, output: TerminalPrint) -> None:
-        output.display(f'Status: {self.__status}')
+    def render(self) -> str:
+        return f'Status: {self.__status}'
 
 
 class Note(UnnecessaryField):
+    __slots__ = ('_note',)
+
     def __init__(self, note: str = None):
         self._note = note
 
@@ -230,13 +294,18 @@ class Note(UnnecessaryField):
         return self._note
 
     def set_value(self, new_note: str) -> None:
+        old_value: str = self._note
         self._note = new_note
+        self._notify(old_value)
 
-    def display(self, output: TerminalPrint) -> None:
-        output.display(f'Note: {self._note}')
+    def render(self) -> str:
+        return f'Note: {self._note}'
 
 
 class Record:
+    fields = ('name', 'phone', 'email', 'bd', 'status', 'note')
+    __slots__ = fields + ('_book', '_rendered', '__weakref__')
+
     def __init__(self, name: Field, phone: Field = None, email: Field = None,
                  bd: Field = None, status: Field = None, note: UnnecessaryField = None) -> None:
         self.name = name
@@ -245,9 +314,32 @@ class Record:
         self.bd = BirthDay() if not bd else bd
         self.status = Status() if not status else status
         self.note = Note() if not note else note
+        self._book = None
+        self._rendered = None
+        self._bind_fields()
+
+    def __getstate__(self) -> dict:
+        return {field_name: getattr(self, field_name) for field_name in self.fields}
+
+    def __setstate__(self, state: dict) -> None:
+        for field_name in self.fields:
+            setattr(self, field_name, state[field_name])
+        self._book = None
+        self._rendered = None
+        self._bind_fields()
+
+    def _bind_fields(self) -> None:
+        for field_name in self.fields:
+            getattr(self, field_name)._record = self
+
+    def _field_changed(self, field: Observable, old_value: Any) -> None:
+        self._rendered = None
+        if self._book is not None:
+            field_name: str = next(name for name in self.fields if getattr(self, name) is field)
+            self._book.record_changed(self, field_name, old_value)
 
     def _get_fields(self) -> dict:
-        fields_dict: dict = {name: value.get_value() for (name, value) in vars(self).items()}
+        fields_dict: dict = {name: getattr(self, name).get_value() for name in self.fields}
         return fields_dict
 
     @staticmethod
@@ -265,48 +357,241 @@ class Record:
             if value and re.search(parameter, self._parser(value), flags=re.I):
                 return value
 
+    def keywords(self) -> List[str]:
+        return [self._parser(value) for value in self._get_fields().values() if value]
+
+    def render(self) -> str:
+        if self._rendered is None:
+            self._rendered = '\n'.join(getattr(self, field_name).render() for field_name in self.fields)
+        return self._rendered
+
     def display(self, output: TerminalPrint) -> None:
-        for field in vars(self).values():
-            field.display(output)
+        output.display(self.render())
 
     def display_field(self, field_name: str, output: TerminalPrint) -> None | Exception:
-        return vars(self)[field_name].display(output) if field_name in vars(self).keys() else FieldNotExistException
+        return getattr(self, field_name).display(output) if field_name in self.fields else FieldNotExistException
+
+
+REGEX_CHARS = set('.^$*+?{}[]\\|()')
+
+
+def is_pattern(parameter: str) -> bool:
+    if REGEX_CHARS.isdisjoint(parameter):
+        return False
+    try:
+        re.compile(parameter)
+    except re.error:
+        return False
+    return True
 
 
 class AddressBook(UserDict):
 
+    def __init__(self, *args, **kwargs) -> None:
+        self.keyword_index = KeywordIndex()
+        self.name_index = NameIndex()
+        self.birthday_index = BirthdayIndex()
+        self.phone_index = PhoneIndex()
+        self.status_index = FacetIndex('status', lambda status: status)
+        self.domain_index = FacetIndex('email', email_domain)
+        self.month_index = FacetIndex('bd', birth_month)
+        self.fuzzy_index = FuzzyNameIndex()
+        self.indexes: List[RecordIndex] = [self.keyword_index, self.name_index, self.birthday_index, self.phone_index,
+                                           self.status_index, self.domain_index, self.month_index, self.fuzzy_index]
+        self._order: dict = {}
+        self._counter: int = 0
+        self.storage = None
+        self.flusher = None
+        self.parallel_search = None
+        self.generation: int = 0
+        self._changes: dict = {}
+        self._batch_depth: int = 0
+        self._lock = threading.RLock()
+        super().__init__(*args, **kwargs)
+
+    def __getstate__(self) -> dict:
+        return {'data': self.data}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state['data'])
+
+    # _lock is held by every change to the records and indexes and by every storage write,
+    # so a flush from the DebouncedFlusher thread never sees the book half changed
+    def __setitem__(self, name: str, record: Record) -> None:
+        with self._lock:
+            if name in self.data:
+                del self[name]
+            self.data[name] = record
+            record._book = self
+            self.generation += 1
+            self._order[name] = self._counter
+            self._counter += 1
+            for index in self.indexes:
+                index.add(name, record)
+
+    def __delitem__(self, name: str) -> None:
+        with self._lock:
+            record: Record = self.data.pop(name)
+            record._book = None
+            self.generation += 1
+            del self._order[name]
+            for index in self.indexes:
+                index.discard(name)
+
+    def clear(self) -> None:
+        with self._lock:
+            for record in self.data.values():
+                record._book = None
+            self.data.clear()
+            self._order.clear()
+            self.generation += 1
+            for index in self.indexes:
+                index.clear()
+
+    def record_changed(self, record: Record, field_name: str, old_value: Any) -> None:
+        if field_name == 'name':
+            self._rename(record, old_value)
+            return
+        name: str = record.name.get_value()
+        with self._lock:
+            self.generation += 1
+            if field_name == 'phone':
+                taken: list = self.phone_index.conflicts(name, record.phone.get_value())
+                if taken:
+                    # put the old numbers back without notifying, the indexes still hold them
+                    record.phone.get_value()[:] = old_value
+                    raise PhoneExistException(taken[0])
+            for index in self.indexes:
+                if field_name in index.fields:
+                    index.discard(name)
+                    index.add(name, record)
+
+    def _rename(self, record: Record, old_name: str) -> None:
+        new_name: str = record.name.get_value()
+        if new_name == old_name:
+            return
+        with self._lock:
+            if new_name in self.data:
+                record._book = None
+                record.name.set_value(old_name)
+                record._book = self
+                raise RecordExistException(new_name)
+            del self[old_name]
+            self[new_name] = record
+
+    def touch(self, name: str) -> None:
+        with self._lock:
+            self._changes[name] = self.data.get(name)
+        if self._batch_depth:
+            return
+        if self.flusher is not None:
+            self.flusher.schedule(self)
+        else:
+            self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            changes, self._changes = self._changes, {}
+            if changes and self.storage is not None:
+                try:
+                    self.storage.write(changes, self)
+                except Exception:
+                    # keep them for the next flush, behind anything touched since
+                    changes.update(self._changes)
+                    self._changes = changes
+                    raise
+
+    @contextmanager
+    def batch(self) -> Iterator['AddressBook']:
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self.flush()
+
     def add_record(self, record: Record) -> None:
         if record.name.get_value() in self.data:
             raise RecordExistException(record.name.get_value())
-        self.data[record.name.get_value()] = record
+        taken: list = self.phone_index.conflicts(record.name.get_value(), record.phone.get_value())
+        if taken:
+            raise PhoneExistException(taken[0])
+        self[record.name.get_value()] = record
 
     def delete_record(self, name: str) -> None:
         name = self.search_by_name(name)
         if name not in self.data:
             raise RecordNotExistException(name)
-        del self.data[name]
+        del self[name]
 
-    def iterator(self, page: int) -> list:
-        start: int = 0
+    def iterator(self, page: int, cursor: str | None = None) -> Iterator[List[Record]]:
         while True:
-            data = list(self.data.values())[start: start+page]
-            if not data:
+            names: List[str] = self.name_index.after(cursor, page)
+            if not names:
                 break
-            yield data
-            start += page
+            yield [self.data[name] for name in names]
+            cursor = names[-1]
 
-    def search_by_keyword(self, parameter: str) -> List[Record] | str:
+    def search_by_keyword(self, parameter: str) -> List[Record]:
+        if is_pattern(parameter):
+            res = self._search_by_pattern(parameter)
+        else:
+            res = [self.data[name] for name in sorted(self.keyword_index.search(parameter), key=self._order.get)]
+        if not res:
+            raise SearchException(parameter)
+        return res
+
+    def _search_by_pattern(self, parameter: str) -> List[Record]:
+        # only records with the literal parts of the pattern are matched against it, e.g. '@ukr\.net$'
+        # runs on the records that have 'ukr.net' instead of on all of them
+        names: Set[str] | None = self.keyword_index.candidates(required_literals(parameter))
+        if names is not None:
+            return [self.data[name] for name in sorted(names, key=self._order.get) if self.data[name].search(parameter)]
+        if self.parallel_search is not None and len(self.data) >= self.parallel_search.threshold:
+            return [self.data[name] for name in self.parallel_search.search(self, parameter)]
         res = []
         for record in self.data.values():
             if record.search(parameter):
                 res.append(record)
-        return res if res else SearchException(parameter)
+        return res
+
+    def search_by_phone(self, number: str) -> List[Record]:
+        res: list = [self.data[name] for name in sorted(self.phone_index.search(number), key=self._order.get)]
+        if not res:
+            raise SearchException(number)
+        return res
+
+    def filter(self, status: str = None, domain: str = None, month: int = None) -> List[Record]:
+        groups: list = [index.get(value) for index, value in ((self.status_index, status),
+                                                              (self.domain_index, domain and domain.lower()),
+                                                              (self.month_index, month)) if value is not None]
+        if not groups:
+            raise SearchException('an empty filter')
+        groups.sort(key=len)
+        names: set = groups[0].intersection(*groups[1:])
+        if not names:
+            raise SearchException(', '.join(str(value) for value in (status, domain, month) if value is not None))
+        return [self.data[name] for name in sorted(names, key=self._order.get)]
+
+    def upcoming_birthdays(self, days: int, today: datetime.date = None) -> List[tuple]:
+        today = today or datetime.date.today()
+        return [(days_left, self.data[name]) for days_left, name in self.birthday_index.upcoming(days, today)]
 
     def search_by_name(self, name) -> str:
+        if name in self.data:
+            return name
+        key: str | None = self.name_index.find(name)
+        if key is not None:
+            return key
+        pattern: re.Pattern = re.compile(name if is_pattern(name) else re.escape(name), flags=re.I)
         for key in self.data:
-            if re.search(name, key, flags=re.I):
+            if pattern.search(key):
                 return key
-        raise NameNotExistException(name)
+        raise NameNotExistException(name, lambda: [key for _, key in self.search_fuzzy(name, 3)])
+
+    def search_fuzzy(self, name: str, count: int = 5) -> List[tuple]:
+        return self.fuzzy_index.search(name, count)
 
 
 contacts = AddressBook()
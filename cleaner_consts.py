@@ -37,7 +37,7 @@ table = {ord(unicodedata.normalize('NFC', 'а')): 'a',
          ord(unicodedata.normalize('NFC', 'Б')): 'B',
          ord(unicodedata.normalize('NFC', 'В')): 'V',
          ord(unicodedata.normalize('NFC', 'Г')): 'H',
-         ord(unicodedata.normalize('NFC', 'ґ')): 'G',
+         ord(unicodedata.normalize('NFC', 'Ґ')): 'G',
          ord(unicodedata.normalize('NFC', 'Д')): 'D',
          ord(unicodedata.normalize('NFC', 'Е')): 'E',
          ord(unicodedata.normalize('NFC', 'Є')): 'Ye',
@@ -2,60 +2,130 @@ import asyncio
 import aiofiles
 import aiofiles.os
 import aioshutil
-from aiopath import AsyncPath
 
 import os
-import re
+import json
+import shutil
 import unicodedata
+from functools import lru_cache
 from cleaner_consts import table
-from typing import Tuple, Callable
+from typing import Iterable, Iterator, List, Tuple, Callable
 from classes import TerminalView
 
 cleaner_commands = TerminalView()
 cleaner_commands_comm = '''\n\tNow you are in the cleaning module. In this module I help you to sort all files 
     in the chosen directory thus cleaning your folder.
     To do that, type the path to your folder according the pattern: <DISC:\\Folder\\Other folder...>
+    To only see what would be moved, type: <plan DISC:\\Folder...>, the plan is written to cleaner_plan.jsonl.
+    To carry out the written plan (or to continue an interrupted one), type: <apply>
+    Your own categories can be described in cleaner_rules.json: {"books": ["epub", "fb2"], "archive": ["tbz2", "txz"]}
     To back to main menu, type: <back>'''
 cleaner_commands.add_command(cleaner_commands_comm)
 root = ''
+WORKERS = 16
+PLAN_FILE = 'cleaner_plan.jsonl'
 
 
-async def process_directory(directory) -> None:
-    async for path in AsyncPath(directory).iterdir():
-        if await path.is_file():
-            await process_file(directory, path.name)
-        elif await path.is_dir() and path.name.lower() not in extensions.keys():
-            await process_directory(path)
+def scan_directory(directory: str) -> Tuple[List[str], List[str]]:
+    files, folders = [], []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file():
+                files.append(entry.name)
+            elif entry.is_dir() and entry.name.lower() not in extensions.keys() and entry.name.lower() != 'other':
+                folders.append(entry.path)
+    return files, folders
 
-    '''for file in os.listdir(directory):
-        file_path: str = os.path.join(directory, file)
-        if await aiofiles.os.path.isfile(file_path):
-            await process_file(directory, file)
-        elif await aiofiles.os.path.isdir(file_path) and file.lower() not in extensions.keys():
-            await process_directory(file_path)'''
+
+async def walk(directory: str, queue: asyncio.Queue, folders: List[str]) -> None:
+    pending: list = [directory]
+    while pending:
+        current: str = pending.pop()
+        files, subfolders = await asyncio.to_thread(scan_directory, current)
+        folders.append(current)
+        pending += subfolders
+        for file in files:
+            await queue.put((current, file))
+
+
+def walk_tree(directory: str) -> Iterator[Tuple[str, List[str]]]:
+    pending: list = [directory]
+    while pending:
+        current: str = pending.pop()
+        files, subfolders = scan_directory(current)
+        pending += subfolders
+        yield current, files
+
+
+async def worker(queue: asyncio.Queue, action: Callable) -> None:
+    while True:
+        item: tuple = await queue.get()
+        try:
+            await action(*item)
+        except Exception as error:
+            # a worker that stops would leave the bounded queue undrained and the walker waiting forever
+            print(f'{item[1]} was not moved: {error}')
+        finally:
+            queue.task_done()
+
+
+async def process_directory(directory: str, workers: int = WORKERS) -> None:
+    # the walker lists folders while up to `workers` files are being moved; the queue is bounded
+    # so the walker does not get far ahead of the moves on a huge tree
+    queue: asyncio.Queue = asyncio.Queue(maxsize=workers * 4)
+    tasks: list = [asyncio.create_task(worker(queue, process_file)) for _ in range(workers)]
+    folders: list = []
+    try:
+        await walk(directory, queue, folders)
+        await queue.join()
+    finally:
+        for task in tasks:
+            task.cancel()
+    for folder in reversed(folders[1:]):
+        await check_folder(folder)
 
 
 async def process_file(file_path, file) -> None:
-    name, extension = file.rsplit('.', 1)
+    name, extension = split_extension(file)
     func_: tuple = handle_func(extension)
     await func_[0](file_path, f'{root}\\{func_[1]}', name, extension)
-    await check_folder(file_path)
-    await asyncio.sleep(0.001)
 
 
-async def move_to(old_path: str, new_path: str, file_name: str, ext: str) -> None:
-    new_name: str = rename(file_name)
-    await aiofiles.os.rename(f'{old_path}\\{file_name}.{ext}', f'{old_path}\\{new_name}.{ext}')
-    i: int = 0
-    while True:
-        if f'{new_name}.{ext}' not in os.listdir(new_path):
-            await aiofiles.os.replace(f'{old_path}\\{new_name}.{ext}', f'{new_path}\\{new_name}.{ext}')
-            break
-        else:
+class NameRegistry:
+    # names taken in every destination folder, listed once per run; a name is reserved before
+    # the file is moved, so concurrent moves never pick the same one
+    def __init__(self) -> None:
+        self._taken: dict = {}
+        self._counters: dict = {}
+
+    def clear(self) -> None:
+        self._taken.clear()
+        self._counters.clear()
+
+    def reserve(self, folder: str, name: str, ext: str) -> str:
+        taken: set | None = self._taken.get(folder)
+        if taken is None:
+            # a folder that does not exist yet (while planning) has no names taken
+            taken = self._taken[folder] = {file.casefold() for file in os.listdir(folder)} \
+                if os.path.isdir(folder) else set()
+        key: tuple = (folder, name.casefold(), ext.casefold())
+        suffix: str = f'.{ext}' if ext else ''  # a folder for an unpacked archive has no extension
+        i: int = self._counters.get(key, 0)
+        file: str = f'{name}{suffix}' if not i else f'{name}_{i}{suffix}'
+        while file.casefold() in taken:
             i += 1
-            file_name = new_name
-            new_name = f'{file_name}_{i}'
-            await aiofiles.os.rename(f'{old_path}\\{file_name}.{ext}', f'{old_path}\\{new_name}.{ext}')
+            file = f'{name}_{i}{suffix}'
+        self._counters[key] = i
+        taken.add(file.casefold())
+        return file
+
+
+names = NameRegistry()
+
+
+async def move_to(old_path: str, new_path: str, file_name: str, ext: str) -> None:
+    new_file: str = names.reserve(new_path, rename(file_name), ext)
+    await aiofiles.os.replace(f'{old_path}\\{file_name}.{ext}', f'{new_path}\\{new_file}')
 
 
 async def move_to_archive(old_path: str, new_path: str, file_name: str, ext: str) -> None:
@@ -69,20 +139,26 @@ async def move_to_archive(old_path: str, new_path: str, file_name: str, ext: str
 
 
 async def move_to_other(old_path: str, new_path: str, file_name: str, ext: str) -> None:
-    new_name: str = rename(file_name)
-    await aiofiles.os.rename(f'{old_path}\\{file_name}.{ext}', f'{old_path}\\{new_name}.{ext}')
-    await aiofiles.os.replace(f'{old_path}\\{file_name}.{ext}', f'{new_path}\\{new_name}.{ext}')
+    await move_to(old_path, new_path, file_name, ext)
+
+
+class Transliteration(dict):
+    # a str.translate table: Cyrillic letters come from cleaner_consts.table, allowed characters
+    # are kept and anything else becomes '_'; characters are added on first sight
+    allowed = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789.-()')
+
+    def __missing__(self, code: int) -> str:
+        char: str = chr(code)
+        self[code] = char if char in self.allowed else '_'
+        return self[code]
 
 
+transliteration = Transliteration(table)
+
+
+@lru_cache(maxsize=65536)
 def rename(file_name: str) -> str:
-    pattern = r'[a-zA-Z0-9\.\-\(\)]'
-    for char in file_name:
-        if not re.match(pattern, char):
-            if ord(unicodedata.normalize('NFC', char.lower())) in table.keys():
-                file_name = file_name.replace(char, char.translate(table))
-            else:
-                file_name = file_name.replace(char, '_')
-    return file_name
+    return unicodedata.normalize('NFC', file_name).translate(transliteration)
 
 
 async def check_folder(old_path: str) -> None:
@@ -95,19 +171,84 @@ extensions = dict(images=[('jpeg', 'png', 'jpg', 'svg'), move_to],
                   documents=[('doc', 'docx', 'txt', 'pdf', 'xlsx', 'pptx'), move_to],
                   audio=[('mp3', 'ogg', 'wav', 'amr', 'm4a'), move_to],
                   web=[('html', 'xml', 'csv', 'json'), move_to],
-                  archive=[('zip', 'gz', 'tar'), move_to_archive])
+                  archive=[('zip', 'gz', 'tar', 'tar.gz', 'tgz', 'tar.bz2', 'tar.xz'), move_to_archive])
+RULES_FILE = 'cleaner_rules.json'
+
+
+def build_handlers(categories: dict) -> dict:
+    return {extension.casefold(): (handler, category.title())
+            for category, (category_extensions, handler) in categories.items() for extension in category_extensions}
+
+
+handlers: dict = build_handlers(extensions)
+extension_parts: int = max(extension.count('.') + 1 for extension in handlers)
+
+
+def add_category(category: str, category_extensions: Iterable[str], handler: Callable = move_to) -> None:
+    # a user rule: a new category gets its own folder, an existing one is extended;
+    # the extensions are taken over from whatever category had them before
+    global extension_parts
+    category = category.lower()
+    category_extensions = tuple(extension.strip('.').casefold() for extension in category_extensions)
+    for other_category, (other_extensions, other_handler) in extensions.items():
+        extensions[other_category] = [tuple(extension for extension in other_extensions
+                                            if extension not in category_extensions), other_handler]
+    extensions[category] = [extensions.get(category, [()])[0] + category_extensions, handler]
+    handlers.clear()
+    handlers.update(build_handlers(extensions))
+    extension_parts = max(extension.count('.') + 1 for extension in handlers)
+
+
+def unpack_extensions() -> set:
+    return {extension.strip('.').casefold()
+            for _, format_extensions, _ in shutil.get_unpack_formats() for extension in format_extensions}
+
+
+def load_rules(path: str = RULES_FILE) -> None:
+    # {"books": ["epub", "fb2"], "archive": ["tbz2", "txz"]}
+    if not os.path.exists(path):
+        return
+    with open(path, encoding='utf-8') as fr:
+        try:
+            rules = json.load(fr)
+        except ValueError as error:
+            print(f'{path} is not valid JSON ({error}), your own categories are not used.')
+            return
+    if not isinstance(rules, dict):
+        print(f'{path} must map categories to lists of extensions, your own categories are not used.')
+        return
+    for category, category_extensions in rules.items():
+        if not isinstance(category_extensions, list) or \
+                not all(isinstance(extension, str) for extension in category_extensions):
+            print(f'Category {category} is left out of the rules: its extensions must be a list of strings.')
+            continue
+        if category.lower() == 'archive':
+            supported: set = unpack_extensions()
+            unsupported: list = [extension for extension in category_extensions
+                                 if extension.strip('.').casefold() not in supported]
+            if unsupported:
+                print(f'Archives {", ".join(unsupported)} can not be unpacked and are left out of the rules.')
+            category_extensions = [extension for extension in category_extensions if extension not in unsupported]
+        add_category(category, category_extensions, move_to_archive if category.lower() == 'archive' else move_to)
+
+
+def split_extension(file: str) -> Tuple[str, str]:
+    # the longest known extension wins, so photos.tar.gz is an archive rather than a .gz file
+    parts: list = file.split('.')
+    for count in range(min(extension_parts, len(parts) - 1), 1, -1):
+        if '.'.join(parts[-count:]).casefold() in handlers:
+            return '.'.join(parts[:-count]), '.'.join(parts[-count:])
+    name, extension = file.rsplit('.', 1)
+    return name, extension
 
 
 def handle_func(file_extension: str) -> Tuple[Callable, str]:
-    for category, extension in extensions.items():
-        if file_extension in extension[0]:
-            return extension[1], category.title()
-    return move_to_other, 'Other'
+    return handlers.get(file_extension.casefold(), (move_to_other, 'Other'))
 
 
 async def after_check(path: str) -> None:
     for folder in os.listdir(path):
-        if get_folder_size(f'{path}\\{folder}') == 0:
+        if os.path.isdir(f'{path}\\{folder}') and get_folder_size(f'{path}\\{folder}') == 0:
             await aioshutil.rmtree(f'{path}\\{folder}')
 
 
@@ -129,6 +270,106 @@ async def make_directories(path: str) -> None:
         print('Something went wrong. Check a validity of the entered path.')
 
 
+def plan_file(directory: str, file: str) -> Tuple[str, str, str]:
+    name, extension = split_extension(file)
+    handler, category = handle_func(extension)
+    folder: str = f'{root}\\{category}'
+    if handler is move_to_archive:
+        return f'{directory}\\{file}', f'{folder}\\{names.reserve(folder, rename(name).title(), "")}', 'unpack'
+    return f'{directory}\\{file}', f'{folder}\\{names.reserve(folder, rename(name), extension)}', 'move'
+
+
+def make_plan(path: str, plan_path: str = PLAN_FILE) -> int:
+    # one line per step: the root first, then [source, destination, action], emptied folders last
+    global root
+    root = path
+    names.clear()
+    count: int = 0
+    folders: list = []
+    with open(plan_path, 'w', encoding='utf-8') as fw:
+        fw.write(json.dumps({'root': path}, ensure_ascii=False) + '\n')
+        for folder, files in walk_tree(path):
+            folders.append(folder)
+            for file in files:
+                try:
+                    fw.write(json.dumps(plan_file(folder, file), ensure_ascii=False) + '\n')
+                    count += 1
+                except ValueError:
+                    print(f'{file} will not be moved: it has no extension')
+        for folder in reversed(folders[1:]):
+            fw.write(json.dumps([folder, '', 'rmdir'], ensure_ascii=False) + '\n')
+    if os.path.exists(plan_path + '.done'):
+        os.remove(plan_path + '.done')
+    return count
+
+
+async def apply_step(source: str, destination: str, action: str) -> None:
+    if not await aiofiles.os.path.exists(source):
+        if await aiofiles.os.path.exists(destination):
+            return  # done before an interruption, but not checkpointed
+        raise FileNotFoundError(f'{source} does not exist')
+    if await aiofiles.os.path.exists(destination):
+        # appeared after planning; the step fails and stays in the plan instead of overwriting it
+        raise FileExistsError(f'{destination} already exists')
+    if action == 'move':
+        await aiofiles.os.rename(source, destination)
+    elif action == 'unpack':
+        # unpacked aside and renamed when complete, so an interrupted unpack is redone from scratch
+        partial: str = destination + '.part'
+        await aioshutil.rmtree(partial, ignore_errors=True)
+        await aioshutil.unpack_archive(source, partial)
+        await aiofiles.os.rename(partial, destination)
+        await aiofiles.os.remove(source)
+
+
+async def apply_plan(plan_path: str = PLAN_FILE, workers: int = WORKERS) -> int:
+    # every finished step is appended to <plan>.done, so a rerun after an interruption skips it
+    global root
+    checkpoint_path: str = plan_path + '.done'
+    done: set = set()
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, encoding='utf-8') as fr:
+            done = {int(line) for line in fr if line.strip().isdigit()}
+    failed: list = []
+    folders: list = []
+    with open(plan_path, encoding='utf-8') as fr, open(checkpoint_path, 'a', encoding='utf-8') as checkpoint:
+
+        async def run_step(number: int, source: str, destination: str, action: str) -> None:
+            try:
+                await apply_step(source, destination, action)
+            except Exception:
+                failed.append(number)
+                raise
+            checkpoint.write(f'{number}\n')
+            checkpoint.flush()
+
+        root = json.loads(fr.readline())['root']
+        await make_directories(root)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=workers * 4)
+        tasks: list = [asyncio.create_task(worker(queue, run_step)) for _ in range(workers)]
+        try:
+            for number, line in enumerate(fr, start=1):
+                source, destination, action = json.loads(line)
+                if number in done:
+                    continue
+                if action == 'rmdir':
+                    folders.append(source)
+                else:
+                    await queue.put((number, source, destination, action))
+            await queue.join()
+        finally:
+            for task in tasks:
+                task.cancel()
+    for folder in folders:
+        if await aiofiles.os.path.exists(folder):
+            await check_folder(folder)
+    await after_check(root)
+    if not failed:
+        os.remove(plan_path)
+        os.remove(checkpoint_path)
+    return len(failed)
+
+
 def instructions() -> None:
     for command in cleaner_commands.display_commands():
         print(command)
@@ -136,12 +377,28 @@ def instructions() -> None:
 
 async def clean_folder_main() -> None:
     instructions()
+    load_rules()
     global root
     while True:
         root = input('\nType a path to a folder to clean: ')
         if root == 'back':
             print('\nYou returned to the main Menu.')
             break
+        if root.startswith('plan '):
+            if os.path.isdir(root[5:].strip()):
+                print(f'{make_plan(root[5:].strip())} files to move, see {PLAN_FILE}.')
+            else:
+                print('Something went wrong. Check a validity of the entered path.')
+            continue
+        if root == 'apply':
+            if not os.path.exists(PLAN_FILE):
+                print('There is no plan yet, type: plan <path>')
+            elif await apply_plan():
+                print(f'Some files were not moved, {PLAN_FILE} is kept to try them again.')
+            else:
+                print('All files from the plan were moved.')
+            continue
+        names.clear()
         await make_directories(root)
         await process_directory(root)
         await after_check(root)
@@ -0,0 +1,47 @@
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+from classes import AddressBook, Record, Name, Phone, Email, BirthDay, Status, Note
+from record_codec import encode_record, decode_record
+from storage import JournalStorage
+
+
+def make_book(count: int) -> AddressBook:
+    book = AddressBook()
+    for i in range(count):
+        record = Record(Name(f'Contact {i:07}'), Phone(f'050{i:07}'), Email(f'contact{i}@gmail.com'),
+                        BirthDay(f'19{i % 100:02}-{i % 12 + 1:02}-{i % 28 + 1:02}'), Status('Friend'),
+                        Note('met at the conference'))
+        book.data[record.name.get_value()] = record
+    return book
+
+
+def measure(title: str, function, count: int) -> None:
+    start: float = time.perf_counter()
+    function()
+    elapsed: float = time.perf_counter() - start
+    print(f'{title:<32}{elapsed:8.3f} s{count / elapsed:12.0f} records/s')
+
+
+def main(count: int = 100000) -> None:
+    book: AddressBook = make_book(count)
+    records: list = list(book.data.values())
+    pickled: list = [pickle.dumps(record) for record in records]
+    encoded: list = [encode_record(record) for record in records]
+    print(f'{count} records, {sum(map(len, pickled)) / count:.0f} bytes pickled, '
+          f'{sum(map(len, encoded)) / count:.0f} bytes encoded per record')
+    measure('pickle.dumps', lambda: [pickle.dumps(record) for record in records], count)
+    measure('encode_record', lambda: [encode_record(record) for record in records], count)
+    measure('pickle.loads', lambda: [pickle.loads(data) for data in pickled], count)
+    measure('decode_record', lambda: [decode_record(data) for data in encoded], count)
+    with tempfile.TemporaryDirectory() as directory:
+        storage = JournalStorage(os.path.join(directory, 'contacts.bin'), os.path.join(directory, 'contacts.journal'))
+        measure('snapshot save', lambda: storage.save(book), count)
+        measure('snapshot load', storage.load, count)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -47,10 +47,16 @@ class SearchException(Exception):
 
 
 class NameNotExistException(Exception):
-    def __init__(self, name_for_verification: str) -> None:
+    def __init__(self, name_for_verification: str, suggest=None) -> None:
         self.message = f'Name {name_for_verification} does not exist.'
+        self.suggest = suggest
         super().__init__(self.message)
 
+    def __str__(self) -> str:
+        # the similar names are only looked up when the error is shown, not on every failed lookup
+        suggestions: list = self.suggest() if self.suggest is not None else []
+        return self.message + (f' Did you mean: {", ".join(suggestions)}?' if suggestions else '')
+
 
 class PhoneNotExistException(Exception):
     def __init__(self, number_for_verification: str) -> None:
@@ -86,3 +92,15 @@ class FieldNotExistException(Exception):
     def __init__(self, field_for_verification: str) -> None:
         self.message = f'A such field: {field_for_verification} does not exist.'
         super().__init__(self.message)
+
+
+class SnapshotCorruptedException(Exception):
+    def __init__(self, part_for_verification: str) -> None:
+        self.message = f'Checksum of {part_for_verification} does not match, the address book file is damaged.'
+        super().__init__(self.message)
+
+
+class RecordFormatException(Exception):
+    def __init__(self, version_for_verification: int | None) -> None:
+        self.message = f'Record format version {version_for_verification} is not supported by this version.'
+        super().__init__(self.message)
@@ -1,7 +1,15 @@
+import datetime
 import re
-from classes import AddressBook, Record, Name, contacts, output_, commands_addressbook, TerminalView, TerminalPrint
-import pickle
+from itertools import islice
+from typing import Iterator
+from classes import AddressBook, Record, Name, contacts, output_, commands_addressbook, TerminalView, TerminalPrint, \
+    BufferedOutput
+from storage import JournalStorage, SnapshotView, DebouncedFlusher
+from bulk import import_contacts, export_contacts
+from parallel_search import ParallelSearch
+from exceptions_address_book import SnapshotCorruptedException
 from functools import wraps
+import atexit
 import collections
 
 
@@ -18,23 +26,38 @@ And also a correctness of the entered name or/and phone number. And, of course,
     return inner_func
 
 
+storage = JournalStorage('contacts.bin', 'contacts.journal')
+contacts.storage = storage
+contacts.parallel_search = ParallelSearch()
+atexit.register(contacts.flush)
+
+
 def write_info_from_class(obj: AddressBook) -> None:
-    with open('contacts.bin', 'wb') as fr:
-        pickle.dump(obj, fr)
+    with obj._lock:
+        storage.save(obj)
 
 
-def read_info_from_file() -> AddressBook:
-    with open('contacts.bin', 'rb') as fr:
-        contacts_from_file: AddressBook = pickle.load(fr)
+def read_info_from_file(obj: AddressBook = None) -> AddressBook:
+    contacts_from_file: AddressBook = storage.load(obj)
     return contacts_from_file
 
 
+script: Iterator[str] | None = None
+
+
+def read_input(prompt: str) -> str:
+    # while a script is running, the answers to the prompts are the lines that follow the command
+    if script is not None:
+        return next(script, '')
+    return input(prompt)
+
+
 @input_error
 def add_contact(name: str, contact_book: AddressBook) -> None:
     name: Name = Name(name)
     record: Record = Record(name)
     contact_book.add_record(record)
-    write_info_from_class(contact_book)
+    contact_book.touch(name.get_value())
 
 
 add_contact_comm = """
@@ -46,8 +69,9 @@ commands_addressbook.add_command(add_contact_comm)
 
 @input_error
 def delete_contact(name: str, contact: AddressBook) -> None:
+    name = contact.search_by_name(name)
     contact.delete_record(name)
-    write_info_from_class(contact)
+    contact.touch(name)
 
 
 delete_contact_comm = """
@@ -58,7 +82,8 @@ commands_addressbook.add_command(delete_contact_comm)
 @input_error
 def search(keyword: str, contact: AddressBook, output: TerminalPrint) -> None:
     result: list = contact.search_by_keyword(keyword)
-    [res.display(output) for res in result]
+    with BufferedOutput(output) as buffer:
+        [res.display(buffer) for res in result]
 
 
 search_comm = """
@@ -67,11 +92,45 @@ search_comm = """
 commands_addressbook.add_command(search_comm)
 
 
-def show_contacts(output: TerminalPrint, pages: int = 2) -> None:
-    contacts_download = read_info_from_file()
-    for record in contacts_download.iterator(pages):
-        [field.display(output) for field in record]
-        input('Press "Enter": ')
+@input_error
+def search_phone(number: str, contact: AddressBook, output: TerminalPrint) -> None:
+    with BufferedOutput(output) as buffer:
+        [res.display(buffer) for res in contact.search_by_phone(number)]
+
+
+search_phone_comm = """
+    To find who owns a phone number, type: search phone <phone number or its last 7 digits>"""
+commands_addressbook.add_command(search_phone_comm)
+
+
+@input_error
+def search_similar(name: str, contact: AddressBook) -> None:
+    candidates: list = contact.search_fuzzy(name)
+    if not candidates:
+        print(f'There are no names similar to {name}.')
+    for similarity, candidate in candidates:
+        print(f'{candidate}: {similarity:.0%}')
+
+
+search_similar_comm = """
+    To find names that are written similarly to a given one (with typos or in Cyrillic), type: similar <name>"""
+commands_addressbook.add_command(search_similar_comm)
+
+
+def show_contacts(output: TerminalPrint, pages: int = 2, cursor: str = None) -> None:
+    contacts.flush()
+    contacts_download = storage.open()
+    buffer = BufferedOutput(output)
+    try:
+        for record in contacts_download.iterator(pages, cursor):
+            [field.display(buffer) for field in record]
+            if script is None:
+                buffer.flush()
+                input('Press "Enter": ')
+    finally:
+        buffer.flush()
+        if isinstance(contacts_download, SnapshotView):
+            contacts_download.close()
 
 
 show_contacts_comm = """
@@ -79,6 +138,15 @@ show_contacts_comm = """
 commands_addressbook.add_command(show_contacts_comm)
 
 
+def show_contacts_from(name: str, output: TerminalPrint) -> None:
+    show_contacts(output, cursor=name)
+
+
+show_contacts_from_comm = """
+    To continue showing notices of an address book after some contact, type: show from <name of a contact>"""
+commands_addressbook.add_command(show_contacts_from_comm)
+
+
 def show_commands(commands: TerminalView) -> None:
     print('\n\tGeneral commands for all written contacts:\n'
           '\tNames, phone numbers, emails and other parameters have to be written without brackets <...>')
@@ -96,10 +164,11 @@ def change_name(name: str, contact: AddressBook) -> None:
     name: str = contact.search_by_name(name)
     contact_data: Record = contact.data[name]
     contact.delete_record(name)
-    new_name: str = input('Please enter a new name for the contact: ')
+    new_name: str = read_input('Please enter a new name for the contact: ')
     contact_data.name.set_value(new_name)
     contact.add_record(contact_data)
-    write_info_from_class(contact)
+    contact.touch(name)
+    contact.touch(contact_data.name.get_value())
 
 
 change_name_comm = """
@@ -110,10 +179,10 @@ commands_addressbook.add_command(change_name_comm)
 @input_error
 def add_phone_number(name: str, contact: AddressBook) -> None:
     name = contact.search_by_name(name)
-    number: str = input('Please enter a phone number according to a phone pattern: +<code of a country>XXXXXXXXX '
-                        'or <operator code>XXXXXXX: ')
+    number: str = read_input('Please enter a phone number according to a phone pattern: '
+                             '+<code of a country>XXXXXXXXX or <operator code>XXXXXXX: ')
     contact.data[name].phone.set_value(number)
-    write_info_from_class(contact)
+    contact.touch(name)
 
 
 add_phone_number_comm = """
@@ -129,9 +198,9 @@ commands_addressbook.add_command(add_phone_number_comm)
 @input_error
 def delete_phone_number(name: str, contact: AddressBook) -> None:
     name = contact.search_by_name(name)
-    number: str = input('Please enter a number to delete: ')
+    number: str = read_input('Please enter a number to delete: ')
     contact.data[name].phone.delete_phone_number(number)
-    write_info_from_class(contact)
+    contact.touch(name)
 
 
 delete_phone_number_comm = """
@@ -142,11 +211,11 @@ commands_addressbook.add_command(delete_phone_number_comm)
 @input_error
 def change_phone_number(name: str, contact: AddressBook) -> None:
     name = contact.search_by_name(name)
-    phone_num: str = input('Enter <an old phone number>-<new phone number> for the contact: ')
+    phone_num: str = read_input('Enter <an old phone number>-<new phone number> for the contact: ')
     old, new = phone_num.strip().split('-')
     contact.data[name].phone.delete_phone_number(old)
     contact.data[name].phone.set_value(new)
-    write_info_from_class(contact)
+    contact.touch(name)
 
 
 change_phone_number_comm = """
@@ -157,9 +226,9 @@ commands_addressbook.add_command(change_phone_number_comm)
 @input_error
 def change_email(name: str, contact: AddressBook) -> None:
     name = contact.search_by_name(name)
-    email: str = input('Please enter an email for the contact: ')
+    email: str = read_input('Please enter an email for the contact: ')
     contact.data[name].email.set_value(email)
-    write_info_from_class(contact)
+    contact.touch(name)
 
 
 change_email_comm = """
@@ -172,9 +241,9 @@ commands_addressbook.add_command(change_email_comm)
 @input_error
 def change_birthdate(name: str, contact: AddressBook) -> None:
     name = contact.search_by_name(name)
-    birthdate: str = input('Please enter a date of birth for the contact according to pattern YYYY-MM-DD: ')
+    birthdate: str = read_input('Please enter a date of birth for the contact according to pattern YYYY-MM-DD: ')
     contact.data[name].bd.set_value(birthdate)
-    write_info_from_class(contact)
+    contact.touch(name)
 
 
 change_birthdate_comm = """
@@ -196,13 +265,44 @@ days_to_birthday_comm = """
 commands_addressbook.add_command(days_to_birthday_comm)
 
 
+@input_error
+def show_birthdays(days: str, contact: AddressBook) -> None:
+    upcoming: list = contact.upcoming_birthdays(int(days))
+    if not upcoming:
+        print(f'There are no birthdays in the next {days} days.')
+    for days_left, record in upcoming:
+        print(f'{record.name.get_value()}: in {days_left} days, {record.bd.get_value().strftime("%d %B")}')
+
+
+show_birthdays_comm = """
+    To show all contacts whose birthday is in the next N days, type: birthdays <N>"""
+commands_addressbook.add_command(show_birthdays_comm)
+
+
+@input_error
+def filter_contacts(conditions: str, contact: AddressBook, output: TerminalPrint) -> None:
+    facets: dict = dict(condition.split('=', 1) for condition in conditions.split())
+    if facets.get('month') == 'this':
+        facets['month'] = datetime.date.today().month
+    elif 'month' in facets:
+        facets['month'] = int(facets['month'])
+    with BufferedOutput(output) as buffer:
+        [res.display(buffer) for res in contact.filter(**facets)]
+
+
+filter_contacts_comm = """
+    To show contacts with a status, an email domain and/or a birthday month, combining any of them, type:
+    filter status=<status> domain=<email domain> month=<number of a month or this>"""
+commands_addressbook.add_command(filter_contacts_comm)
+
+
 @input_error
 def change_status(name: str, contact: AddressBook) -> None:
     name = contact.search_by_name(name)
-    status: str = input('Please enter one of statuses to this contact: '
-                        'Friend, Family, Co-Worker, Special. Or leave it empty: ')
+    status: str = read_input('Please enter one of statuses to this contact: '
+                             'Friend, Family, Co-Worker, Special. Or leave it empty: ')
     contact.data[name].status.set_value(status)
-    write_info_from_class(contact)
+    contact.touch(name)
 
 
 change_status_comm = """
@@ -216,9 +316,9 @@ commands_addressbook.add_command(change_status_comm)
 @input_error
 def add_note(name: str, contact: AddressBook) -> None:
     name = contact.search_by_name(name)
-    note: str = input('Please enter a note for the contact: ')
+    note: str = read_input('Please enter a note for the contact: ')
     contact.data[name].note.set_value(note)
-    write_info_from_class(contact)
+    contact.touch(name)
 
 
 add_note_comm = """
@@ -231,7 +331,7 @@ commands_addressbook.add_command(add_note_comm)
 @input_error
 def show_field(name: str, contact: AddressBook, output: TerminalView) -> None:
     name_check = contact.search_by_name(name)
-    field: str = input('Please type a field you want to see for this contact: ')
+    field: str = read_input('Please type a field you want to see for this contact: ')
     contact.data[name_check].display_field(field, output)
 
 
@@ -240,7 +340,64 @@ show_field_comm = """
 commands_addressbook.add_command(show_field_comm)
 
 
+@input_error
+def import_file(path: str, contact: AddressBook) -> None:
+    imported, errors = import_contacts(path, contact)
+    write_info_from_class(contact)
+    print(f'{imported} contact(s) imported, {len(errors)} row(s) skipped.')
+    for line, error in errors[:10]:
+        print(f'Row {line}: {error}')
+
+
+import_file_comm = """
+    To import contacts from a .csv, .json (one contact per line) or .vcf file, type: import <path to the file>
+    Columns of a .csv file: name, phone, email, bd, status, note. Several phone numbers are separated by ;"""
+commands_addressbook.add_command(import_file_comm)
+
+
+@input_error
+def export_file(path: str, contact: AddressBook) -> None:
+    print(f'{export_contacts(contact, path)} contact(s) exported to {path}.')
+
+
+export_file_comm = """
+    To export all contacts to a .csv, .json or .vcf file, type: export <path to the file>"""
+commands_addressbook.add_command(export_file_comm)
+
+
+@input_error
+def run_script(path: str) -> None:
+    global script
+    outer_script: Iterator[str] | None = script
+    with open(path, encoding='utf-8') as fr:
+        lines: Iterator[str] = (line.rstrip('\r\n') for line in fr)
+        try:
+            with contacts.batch():
+                for line in lines:
+                    if line.strip() and not line.lstrip().startswith('#'):
+                        # the answers are taken off before the command runs, so a command that fails
+                        # before asking its question does not leave its answer to be run as a command
+                        parsed: tuple | None = command_parser(line)
+                        script = iter(list(islice(lines, answer_lines.get(parsed[0], 0) if parsed else 0)))
+                        make_function(line)
+        finally:
+            # a script run from another script hands the prompts back to the outer one
+            script = outer_script
+
+
+run_script_comm = """
+    To run commands from a text file, one command per line followed by the answers to its questions, type:
+    run <path to the file>"""
+commands_addressbook.add_command(run_script_comm)
+
+
 def farewell(contact: AddressBook) -> None:
+    if contact.flusher is not None:
+        contact.flusher.cancel()
+        contact.flusher = None
+    if contact.parallel_search is not None:
+        contact.parallel_search.close()
+    contact.flush()
     write_info_from_class(contact)
     print('All changes saved successfully.\n'
           '\nYou returned to the main Menu.')
@@ -255,10 +412,13 @@ def greeting(contact: AddressBook):
     print('\n\tNow you are in your personal addressbook.\n'
           '\tI can help you with adding, changing, showing and storing all contacts and data connected with them.')
     try:
-        contact.data.clear()
-        [contact.add_record(value) for value in read_info_from_file().values()]
+        with contact._lock:
+            if not storage.sync(contact):
+                read_info_from_file(contact)
     except (FileExistsError, FileNotFoundError):
         print('There are not records yet. Your addressbook is empty.')
+    except SnapshotCorruptedException as error:
+        print(f'{error}\nIt was kept as {storage.snapshot_path}.damaged, a new addressbook is started.')
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -267,7 +427,10 @@ Function = collections.namedtuple('Function', ['function', 'records', 'terminal_
 methods = {'add contact': Function(add_contact, AddressBook, '', ''),
            'delete contact': Function(delete_contact, AddressBook, '', ''),
            'search': Function(search, AddressBook, TerminalPrint, ''),
+           'search phone': Function(search_phone, AddressBook, TerminalPrint, ''),
+           'similar': Function(search_similar, AddressBook, '', ''),
            'show all': Function(show_contacts, '', TerminalPrint, ''),
+           'show from': Function(show_contacts_from, '', TerminalPrint, ''),
            'change name': Function(change_name, AddressBook, '', ''),
            'add phone': Function(add_phone_number, AddressBook, '', ''),
            'change phone': Function(change_phone_number, AddressBook, '', ''),
@@ -275,17 +438,49 @@ methods = {'add contact': Function(add_contact, AddressBook, '', ''),
            'change email': Function(change_email, AddressBook, '', ''),
            'change bd': Function(change_birthdate, AddressBook, '', ''),
            'days to bd': Function(days_to_birthday, AddressBook, '', ''),
+           'birthdays': Function(show_birthdays, AddressBook, '', ''),
+           'filter': Function(filter_contacts, AddressBook, TerminalPrint, ''),
            'change status': Function(change_status, AddressBook, '', ''),
            'add note': Function(add_note, AddressBook, '', ''),
            'help': Function(show_commands, '', '', TerminalView),
-           'show field': Function(show_field, AddressBook, TerminalPrint, ''), }
+           'show field': Function(show_field, AddressBook, TerminalPrint, ''),
+           'import': Function(import_file, AddressBook, '', ''),
+           'export': Function(export_file, AddressBook, '', ''),
+           'run': Function(run_script, '', '', ''), }
+
+# how many lines after the command a script gives as the answers to the command's questions
+answer_lines = {'change name': 1, 'add phone': 1, 'change phone': 1, 'delete phone': 1, 'change email': 1,
+                'change bd': 1, 'change status': 1, 'add note': 1, 'show field': 1}
+
+
+TOKEN = re.compile(r'\S+')
+
+
+def build_command_trie(commands: dict) -> dict:
+    trie: dict = {}
+    for command in commands:
+        node: dict = trie
+        for token in command.lower().split():
+            node = node.setdefault(token, {})
+        node[None] = command
+    return trie
+
+
+command_trie: dict = build_command_trie(methods)
 
 
 @input_error
 def command_parser(command: str) -> tuple:
-    for func in methods:
-        if re.search(func, command, flags=re.I):
-            return func, re.sub(func, '', command, flags=re.I).strip()
+    node: dict = command_trie
+    found, end = None, 0
+    for token in TOKEN.finditer(command):
+        node = node.get(token.group().lower())
+        if node is None:
+            break
+        if None in node:
+            found, end = node[None], token.end()
+    if found:
+        return found, command[end:].strip()
 
 
 def handler(function_name: str) -> collections.namedtuple:  # Tuple[Callable, None | AddressBook, None | TerminalView]:
@@ -302,6 +497,8 @@ def make_function(text: str) -> None:
             func.function(argument, contacts)
         elif argument and func.terminal_output and not func.records:
             func.function(argument, output_)
+        elif argument and not func.records and not func.terminal_output and not func.terminal_commands:
+            func.function(argument)
         elif not argument and func.terminal_output and not func.records:
             func.function(output_)
         elif not argument and func.terminal_commands and not func.records:
@@ -313,9 +510,10 @@ def make_function(text: str) -> None:
 
 def address_book_main():
     greeting(contacts)
+    contacts.flusher = DebouncedFlusher()
     show_commands(commands_addressbook)
     while True:
-        text: str = input('\nEnter your command: ')
+        text: str = read_input('\nEnter your command: ')
         if text == 'back':
             farewell(contacts)
             break
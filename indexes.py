@@ -0,0 +1,466 @@
+import bisect
+import calendar
+import datetime
+import heapq
+import math
+import re
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import Counter, defaultdict
+from typing import Any, Callable, Hashable, Iterable, List, Set
+
+from cleaner_consts import table
+
+PHONE_SUFFIX = 7
+QUANTIFIER = re.compile(r'\*|\+|\?|\{\d*(,\d*)?\}')
+NON_DIGITS = re.compile(r'\D')
+ESCAPE_LENGTHS = {'x': 2, 'u': 4, 'U': 8}  # characters taken by \x41, \u0410 and \U0001f600 after the letter
+
+
+class RecordIndex(ABC):
+    fields: tuple = ()
+
+    @abstractmethod
+    def add(self, name: str, record: Any) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def discard(self, name: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def clear(self) -> None:
+        raise NotImplementedError
+
+
+class LazyIndex(RecordIndex):
+    # add() only notes the record and the index takes in everything noted before its next query,
+    # so loading a book does not pay for indexes that may never be used
+    def __init__(self) -> None:
+        self._pending: dict = {}
+
+    def add(self, name: str, record: Any) -> None:
+        self._pending[name] = record
+
+    def discard(self, name: str) -> None:
+        self._pending.pop(name, None)
+        self._remove(name)
+
+    def clear(self) -> None:
+        self._pending.clear()
+        self._reset()
+
+    def _build(self) -> None:
+        pending, self._pending = self._pending, {}
+        for name, record in pending.items():
+            self._insert(name, record)
+
+    @abstractmethod
+    def _insert(self, name: str, record: Any) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def _remove(self, name: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def _reset(self) -> None:
+        raise NotImplementedError
+
+
+def trigrams(text: str) -> Set[str]:
+    return {text[i: i + 3] for i in range(len(text) - 2)} if len(text) > 2 else {text}
+
+
+def required_literals(pattern: str) -> List[str]:
+    # the literal runs every match of a pattern has to contain, read conservatively: nothing inside a group
+    # or a class counts, an alternation outside a group means there are none, and any other special
+    # character, escape or quantifier ends a run
+    if re.compile(pattern).flags & re.VERBOSE:
+        return []
+    runs: list = []
+    run: str = ''
+    depth: int = 0
+    i: int = 0
+    while i < len(pattern):
+        char: str = pattern[i]
+        literal: str | None = None
+        quantifier: re.Match | None = QUANTIFIER.match(pattern, i)
+        if quantifier:
+            # the atom before it may be missing or repeated, so it stays in the run only for '+'
+            if quantifier.group() != '+':
+                run = run[:-1]
+            runs.append(run)
+            run = ''
+            i = quantifier.end()
+            if i < len(pattern) and pattern[i] in '?+':
+                i += 1  # a lazy or possessive quantifier
+            continue
+        if char == '\\':
+            following: str = pattern[i + 1: i + 2]
+            if following and not following.isalnum():
+                literal = following
+                i += 2
+            else:
+                i += 2 + ESCAPE_LENGTHS.get(following, 0)
+                if following == 'N' and pattern[i: i + 1] == '{':
+                    i = pattern.index('}', i) + 1
+                while following.isdigit() and i < len(pattern) and pattern[i].isdigit():
+                    i += 1
+        elif char == '[':
+            i += 1
+            if pattern[i: i + 1] == '^':
+                i += 1
+            if pattern[i: i + 1] == ']':
+                i += 1
+            while i < len(pattern) and pattern[i] != ']':
+                i += 2 if pattern[i] == '\\' else 1
+            i += 1
+        elif char == '|' and not depth:
+            return []
+        else:
+            depth += (char == '(') - (char == ')')
+            if char not in '()|.^$':
+                literal = char
+            i += 1
+        if literal is not None and not depth:
+            run += literal
+        else:
+            runs.append(run)
+            run = ''
+    runs.append(run)
+    return [run.lower() for run in runs if len(run) > 2]
+
+
+class KeywordIndex(LazyIndex):
+    fields = ('name', 'phone', 'email', 'bd', 'status', 'note')
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._postings: defaultdict = defaultdict(set)
+        self._texts: dict = {}
+
+    def _insert(self, name: str, record: Any) -> None:
+        texts: tuple = tuple(text.lower() for text in record.keywords())
+        self._texts[name] = texts
+        postings: defaultdict = self._postings
+        for gram in self._grams(texts):
+            postings[gram].add(name)
+
+    @staticmethod
+    def _grams(texts: tuple) -> Set[str]:
+        # the grams across the line breaks only add candidates that search() then rules out
+        text: str = '\n'.join(texts)
+        return {text[i: i + 3] for i in range(len(text) - 2)}
+
+    def _remove(self, name: str) -> None:
+        for gram in self._grams(self._texts.pop(name, ())):
+            names: set = self._postings.get(gram)
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del self._postings[gram]
+
+    def _reset(self) -> None:
+        self._postings.clear()
+        self._texts.clear()
+
+    def search(self, keyword: str) -> Set[str]:
+        self._build()
+        keyword = keyword.lower()
+        candidates: Iterable[str] = self._texts
+        if len(keyword) > 2:
+            postings: list = sorted((self._postings.get(gram, set()) for gram in trigrams(keyword)), key=len)
+            candidates = set.intersection(*postings) if postings[0] else set()
+        return {name for name in candidates if any(keyword in text for text in self._texts[name])}
+
+    def candidates(self, literals: List[str]) -> Set[str] | None:
+        # names whose texts have every trigram of the literals, or None if there is nothing to narrow by
+        grams: set = set().union(*map(trigrams, literals))
+        if not grams:
+            return None
+        self._build()
+        postings: list = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+        return postings[0].intersection(*postings[1:])
+
+
+class NameIndex(RecordIndex):
+    # names are appended and the list is sorted once on the next lookup, so loading or importing
+    # a whole book costs one sort instead of an insort per record
+    fields = ('name',)
+
+    def __init__(self) -> None:
+        self._list: list = []
+        self._sorted: bool = True
+
+    @property
+    def _keys(self) -> list:
+        if not self._sorted:
+            self._list.sort()
+            self._sorted = True
+        return self._list
+
+    def add(self, name: str, record: Any) -> None:
+        key: tuple = (name.casefold(), name)
+        if self._list and key < self._list[-1]:
+            self._sorted = False
+        self._list.append(key)
+
+    def discard(self, name: str) -> None:
+        keys: list = self._keys
+        key: tuple = (name.casefold(), name)
+        position: int = bisect.bisect_left(keys, key)
+        if position < len(keys) and keys[position] == key:
+            del keys[position]
+
+    def clear(self) -> None:
+        self._list.clear()
+        self._sorted = True
+
+    def find(self, name: str) -> str | None:
+        keys: list = self._keys
+        folded: str = name.casefold()
+        position: int = bisect.bisect_left(keys, (folded, ''))
+        if position < len(keys) and keys[position][0].startswith(folded):
+            return keys[position][1]
+        return None
+
+    def after(self, cursor: str | None, count: int) -> List[str]:
+        keys: list = self._keys
+        position: int = bisect.bisect_right(keys, (cursor.casefold(), cursor)) if cursor is not None else 0
+        return [name for _, name in keys[position: position + count]]
+
+
+def name_form(name: str) -> str:
+    # 'Олександр', 'OLEKSANDR' and 'oleksandr' all give 'oleksandr'
+    return unicodedata.normalize('NFC', name).casefold().translate(table)
+
+
+def edit_distance(first: str, second: str) -> int:
+    previous: list = list(range(len(second) + 1))
+    for i, char in enumerate(first, start=1):
+        current: list = [i]
+        for j, other in enumerate(second, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != other)))
+        previous = current
+    return previous[-1]
+
+
+class FuzzyNameIndex(LazyIndex):
+    # trigrams of transliterated, case-folded names; a query counts shared trigrams walking the rarest postings
+    # first and stops taking new names once no newcomer can reach min_similarity or max_candidates are counted
+    fields = ('name',)
+
+    def __init__(self, min_similarity: float = 0.3, max_candidates: int = 2000) -> None:
+        super().__init__()
+        self.min_similarity = min_similarity
+        self.max_candidates = max_candidates
+        self._postings: defaultdict = defaultdict(set)
+        self._sizes: dict = {}
+
+    @staticmethod
+    def _trigrams(name: str) -> Set[str]:
+        return trigrams(f'  {name_form(name)} ')
+
+    def _insert(self, name: str, record: Any) -> None:
+        grams: set = self._trigrams(name)
+        self._sizes[name] = len(grams)
+        for gram in grams:
+            self._postings[gram].add(name)
+
+    def _remove(self, name: str) -> None:
+        if self._sizes.pop(name, None) is None:
+            return
+        for gram in self._trigrams(name):
+            names: set = self._postings.get(gram)
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del self._postings[gram]
+
+    def _reset(self) -> None:
+        self._postings.clear()
+        self._sizes.clear()
+
+    def search(self, name: str, count: int = 5) -> List[tuple]:
+        self._build()
+        grams: set = self._trigrams(name)
+        if not grams:
+            return []
+        postings: list = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+        needed: int = max(1, math.ceil(self.min_similarity * len(grams)))
+        shared: Counter = Counter()
+        for position, names in enumerate(postings):
+            if len(postings) - position >= needed and len(shared) < self.max_candidates:
+                shared.update(names)
+            else:
+                # only names counted so far, the rest can't catch up or don't fit the cap
+                shared.update(shared.keys() & names)
+        scored: list = []
+        for candidate, common in shared.items():
+            if common >= needed:
+                # how much of the query the name covers, so 'Olexandr' still finds 'Oleksandr Petrenko';
+                # the Jaccard index then prefers names without extra parts
+                size: int = self._sizes[candidate]
+                scored.append((common / len(grams), common / (len(grams) + size - common), candidate))
+        best: list = heapq.nlargest(count * 2, scored)
+        form: str = name_form(name)
+        best.sort(key=lambda item: (-item[0], -item[1], edit_distance(form, name_form(item[2])), item[2]))
+        return [(similarity, candidate) for similarity, _, candidate in best[:count]]
+
+
+class FacetIndex(LazyIndex):
+    # groups names by a single derived value of one field, e.g. status or email domain;
+    # filters combine the groups with set intersections
+    def __init__(self, field_name: str, key: Callable[[Any], Hashable | None]) -> None:
+        super().__init__()
+        self.fields = (field_name,)
+        self._key = key
+        self._groups: defaultdict = defaultdict(set)
+        self._values: dict = {}
+
+    def _insert(self, name: str, record: Any) -> None:
+        value: Hashable | None = self._key(getattr(record, self.fields[0]).get_value())
+        if value is not None:
+            self._values[name] = value
+            self._groups[value].add(name)
+
+    def _remove(self, name: str) -> None:
+        value: Hashable | None = self._values.pop(name, None)
+        if value is not None:
+            names: set = self._groups[value]
+            names.discard(name)
+            if not names:
+                del self._groups[value]
+
+    def _reset(self) -> None:
+        self._groups.clear()
+        self._values.clear()
+
+    def get(self, value: Hashable) -> Set[str]:
+        self._build()
+        return self._groups.get(value, set())
+
+
+def email_domain(email: str | None) -> str | None:
+    return email.rpartition('@')[2].lower() if email else None
+
+
+def birth_month(birth_date: datetime.date | None) -> int | None:
+    return birth_date.month if birth_date else None
+
+
+def phone_digits(number: str) -> str:
+    return NON_DIGITS.sub('', number)
+
+
+def phone_key(number: str) -> str:
+    # '+380501234567', '050-123-45-67' and '(050) 1234567' all give '380501234567'
+    digits: str = phone_digits(number)
+    return '38' + digits if digits.startswith('0') else digits
+
+
+class PhoneIndex(RecordIndex):
+    # kept up to date on every add, unlike the lazy indexes: record_changed asks who owns a number
+    # right after it was added to a record, when a pending record would already claim it
+    fields = ('phone',)
+
+    def __init__(self) -> None:
+        self._owners: dict = {}
+        self._suffixes: defaultdict = defaultdict(set)
+        self._numbers: dict = {}
+
+    def add(self, name: str, record: Any) -> None:
+        keys: tuple = tuple(phone_key(number) for number in record.phone.get_value())
+        self._numbers[name] = keys
+        for key in keys:
+            self._owners[key] = name
+            self._suffixes[key[-PHONE_SUFFIX:]].add(name)
+
+    def discard(self, name: str) -> None:
+        for key in self._numbers.pop(name, ()):
+            if self._owners.get(key) == name:
+                del self._owners[key]
+            names: set = self._suffixes.get(key[-PHONE_SUFFIX:])
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del self._suffixes[key[-PHONE_SUFFIX:]]
+
+    def clear(self) -> None:
+        self._owners.clear()
+        self._suffixes.clear()
+        self._numbers.clear()
+
+    def conflicts(self, name: str, numbers: Iterable[str]) -> List[str]:
+        return [number for number in numbers if self._owners.get(phone_key(number), name) != name]
+
+    def search(self, number: str) -> Set[str]:
+        key: str = phone_key(number)
+        if key in self._owners:
+            return {self._owners[key]}
+        # the end of a number is matched as typed: '01234567' must not turn into '3801234567'
+        digits: str = phone_digits(number)
+        if len(digits) < PHONE_SUFFIX:
+            return set()
+        return {name for name in self._suffixes.get(digits[-PHONE_SUFFIX:], ())
+                if any(number_key.endswith(digits) for number_key in self._numbers[name])}
+
+
+def next_birthday(month: int, day: int, today: datetime.date) -> datetime.date:
+    year: int = today.year
+    while True:
+        # people born on Feb 29 celebrate on Feb 28 in non-leap years
+        birthday = datetime.date(year, month, 28 if (month, day) == (2, 29) and not calendar.isleap(year) else day)
+        if birthday >= today:
+            return birthday
+        year += 1
+
+
+# every (month, day) of a leap year, in calendar order
+CALENDAR_DAYS: List[tuple] = [(month, day) for month in range(1, 13)
+                              for day in range(1, calendar.monthrange(2000, month)[1] + 1)]
+
+
+class BirthdayIndex(LazyIndex):
+    # one bucket of names per day of the year, so adding and removing a birthday is a set operation
+    fields = ('bd',)
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._days: defaultdict = defaultdict(set)
+        self._dates: dict = {}
+
+    def _insert(self, name: str, record: Any) -> None:
+        birth_date: datetime.date | None = record.bd.get_value()
+        if birth_date:
+            key: tuple = (birth_date.month, birth_date.day)
+            self._dates[name] = key
+            self._days[key].add(name)
+
+    def _remove(self, name: str) -> None:
+        key: tuple | None = self._dates.pop(name, None)
+        if key is not None:
+            names: set = self._days[key]
+            names.discard(name)
+            if not names:
+                del self._days[key]
+
+    def _reset(self) -> None:
+        self._days.clear()
+        self._dates.clear()
+
+    def upcoming(self, days: int, today: datetime.date) -> List[tuple]:
+        self._build()
+        res: list = []
+        start: int = bisect.bisect_left(CALENDAR_DAYS, (today.month, today.day))
+        for i in range(len(CALENDAR_DAYS)):
+            month, day = CALENDAR_DAYS[(start + i) % len(CALENDAR_DAYS)]
+            names: set | None = self._days.get((month, day))
+            if not names:
+                continue
+            days_left: int = (next_birthday(month, day, today) - today).days
+            if days_left > days:
+                break
+            res += ((days_left, name) for name in sorted(names))
+        return res
@@ -0,0 +1,58 @@
+import os
+import pickle
+import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+from typing import List
+
+from classes import AddressBook
+
+_shard: list = []
+
+
+def _load_shard(data: bytes) -> int:
+    global _shard
+    _shard = pickle.loads(data)
+    return len(_shard)
+
+
+def _search_shard(parameter: str) -> List[str]:
+    pattern: re.Pattern = re.compile(parameter, flags=re.I)
+    search = pattern.search
+    return [name for name, texts in _shard if any(search(text) for text in texts)]
+
+
+class ParallelSearch:
+    # every shard lives in its own single-process executor, so a worker keeps its shard between searches
+    # and only has to receive the pattern; shards are contiguous in insertion order, so concatenating
+    # their results keeps the order of AddressBook.search_by_keyword
+    def __init__(self, workers: int = None, threshold: int = 50000) -> None:
+        self.workers = workers or os.cpu_count() or 1
+        self.threshold = threshold
+        self._executors: List[ProcessPoolExecutor] = []
+        self._generation: int | None = None
+
+    def _load(self, book: AddressBook) -> None:
+        rows: list = [(name, tuple(book.data[name].keywords())) for name in sorted(book.data, key=book._order.get)]
+        size: int = -(-len(rows) // self.workers)
+        if not self._executors:
+            self._executors = [ProcessPoolExecutor(max_workers=1) for _ in range(self.workers)]
+        futures: list = [executor.submit(_load_shard, pickle.dumps(rows[i * size: (i + 1) * size],
+                                                                   protocol=pickle.HIGHEST_PROTOCOL))
+                         for i, executor in enumerate(self._executors)]
+        for future in futures:
+            future.result()
+        self._generation = book.generation
+
+    def search(self, book: AddressBook, parameter: str) -> List[str]:
+        re.compile(parameter)  # a bad pattern fails here instead of in every worker
+        if self._generation != book.generation:
+            self._load(book)
+        futures: list = [executor.submit(_search_shard, parameter) for executor in self._executors]
+        return list(chain.from_iterable(future.result() for future in futures))
+
+    def close(self) -> None:
+        for executor in self._executors:
+            executor.shutdown(cancel_futures=True)
+        self._executors = []
+        self._generation = None
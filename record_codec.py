@@ -0,0 +1,63 @@
+import datetime
+import struct
+from typing import Callable, Dict
+
+from classes import Record, Name, Phone, Email, BirthDay, Status, Note
+from exceptions_address_book import RecordFormatException
+
+# a record is a version byte followed by tagged fields: tag, payload length, payload;
+# empty fields are left out, a phone number is one field per number, and tags a reader
+# does not know (written by a newer version) are skipped, so fields can be added without a new version
+VERSION = 1
+FIELD = struct.Struct('<BI')
+DATE = struct.Struct('<I')
+NAME, PHONE, EMAIL, BIRTHDAY, STATUS, NOTE = range(1, 7)
+
+
+def _text(payload: bytes) -> str:
+    return payload.decode('utf-8')
+
+
+def _date(payload: bytes) -> datetime.date:
+    return datetime.date.fromordinal(DATE.unpack(payload)[0])
+
+
+DECODERS: Dict[int, Callable] = {NAME: _text, EMAIL: _text, BIRTHDAY: _date, STATUS: _text, NOTE: _text}
+
+
+def encode_record(record: Record) -> bytes:
+    parts: list = [bytes((VERSION,))]
+    for tag, payload in ((NAME, record.name.get_value()), (EMAIL, record.email.get_value()),
+                         (STATUS, record.status.get_value()), (NOTE, record.note.get_value())):
+        if payload:
+            payload = payload.encode('utf-8')
+            parts += (FIELD.pack(tag, len(payload)), payload)
+    for number in record.phone.get_value():
+        payload = number.encode('utf-8')
+        parts += (FIELD.pack(PHONE, len(payload)), payload)
+    birth_date: datetime.date | None = record.bd.get_value()
+    if birth_date:
+        parts += (FIELD.pack(BIRTHDAY, DATE.size), DATE.pack(birth_date.toordinal()))
+    return b''.join(parts)
+
+
+def decode_record(data: bytes) -> Record:
+    if not data or data[0] > VERSION:
+        raise RecordFormatException(data[0] if data else None)
+    values: dict = {}
+    phones: list = []
+    position: int = 1
+    end: int = len(data)
+    while position < end:
+        tag, length = FIELD.unpack_from(data, position)
+        position += FIELD.size
+        payload: bytes = data[position: position + length]
+        position += length
+        if tag == PHONE:
+            phones.append(payload.decode('utf-8'))
+        elif tag in DECODERS:
+            values[tag] = DECODERS[tag](payload)
+    # the values were validated when the record was written
+    return Record(Name.restore(values.get(NAME)), Phone.restore(phones), Email.restore(values.get(EMAIL)),
+                  BirthDay.restore(values.get(BIRTHDAY)), Status.restore(values.get(STATUS)),
+                  Note.restore(values.get(NOTE)))
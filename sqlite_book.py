@@ -0,0 +1,322 @@
+import calendar
+import datetime
+import re
+import sqlite3
+import weakref
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from typing import Any, Iterator, List
+
+from classes import Record, Name, Phone, Email, BirthDay, Status, Note, is_pattern
+from exceptions_address_book import *
+from indexes import PHONE_SUFFIX, next_birthday, phone_digits, phone_key, required_literals
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS contacts (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    name_folded TEXT NOT NULL,
+    email TEXT,
+    birthday TEXT,
+    bd_key INTEGER,
+    status TEXT,
+    note TEXT,
+    keywords TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS phones (
+    contact_id INTEGER NOT NULL REFERENCES contacts(id) ON DELETE CASCADE,
+    number TEXT NOT NULL,
+    key TEXT,
+    suffix TEXT
+);
+CREATE INDEX IF NOT EXISTS contacts_name_folded ON contacts(name_folded, name);
+CREATE INDEX IF NOT EXISTS contacts_email ON contacts(email);
+CREATE INDEX IF NOT EXISTS contacts_bd_key ON contacts(bd_key);
+CREATE INDEX IF NOT EXISTS contacts_status ON contacts(status);
+CREATE INDEX IF NOT EXISTS phones_number ON phones(number);
+CREATE INDEX IF NOT EXISTS phones_contact ON phones(contact_id);
+'''
+# created after databases from before the key and suffix columns have been given them
+PHONE_KEYS = '''
+CREATE INDEX IF NOT EXISTS phones_key ON phones(key);
+CREATE INDEX IF NOT EXISTS phones_suffix ON phones(suffix);
+'''
+COLUMNS = 'id, name, email, birthday, status, note'
+
+
+def _keywords_match(keywords: str, pattern: str) -> bool:
+    return any(re.search(pattern, text, flags=re.I) for text in keywords.split('\n'))
+
+
+def _like(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class SQLiteAddressBook(MutableMapping):
+    # the same interface as AddressBook, but records live in an sqlite database and are materialized
+    # only for the rows a query returns; field changes are written through the Record listener hook.
+    # Records handed out are kept in a weak map, so a row is one object while it is in use and
+    # deleting the row detaches it, as AddressBook.__delitem__ does
+    def __init__(self, path: str = 'contacts.db') -> None:
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA foreign_keys = ON')
+        self._db.executescript(SCHEMA)
+        self._add_phone_keys()
+        self._db.executescript(PHONE_KEYS)
+        self._db.create_function('keywords_match', 2, _keywords_match, deterministic=True)
+        self._batch_depth: int = 0
+        self._live = weakref.WeakValueDictionary()
+
+    def _add_phone_keys(self) -> None:
+        # numbers are matched by phone_key, as in PhoneIndex, so every backend finds the same contacts
+        if 'key' in {column[1] for column in self._db.execute('PRAGMA table_info(phones)')}:
+            return
+        self._db.execute('ALTER TABLE phones ADD COLUMN key TEXT')
+        self._db.execute('ALTER TABLE phones ADD COLUMN suffix TEXT')
+        self._db.executemany('UPDATE phones SET key = ?, suffix = ? WHERE rowid = ?',
+                             [(phone_key(number), phone_key(number)[-PHONE_SUFFIX:], rowid)
+                              for rowid, number in self._db.execute('SELECT rowid, number FROM phones').fetchall()])
+        self._db.commit()
+
+    @property
+    def data(self) -> 'SQLiteAddressBook':
+        return self
+
+    def close(self) -> None:
+        self._db.commit()
+        self._db.close()
+
+    def _records(self, rows: List[tuple]) -> List[Record]:
+        phones: dict = {}
+        ids: list = [row[0] for row in rows if row[1] not in self._live]
+        for start in range(0, len(ids), 500):
+            chunk: list = ids[start: start + 500]
+            for contact_id, number in self._db.execute(
+                    f'SELECT contact_id, number FROM phones WHERE contact_id IN ({",".join("?" * len(chunk))}) '
+                    f'ORDER BY rowid', chunk):
+                phones.setdefault(contact_id, []).append(number)
+        records: list = []
+        for contact_id, name, email, birthday, status, note in rows:
+            record: Record | None = self._live.get(name)
+            if record is None:
+                record = Record(Name.restore(name), Phone.restore(phones.get(contact_id, [])), Email.restore(email),
+                                BirthDay.restore(datetime.date.fromisoformat(birthday) if birthday else None),
+                                Status.restore(status), Note.restore(note))
+                record._book = self
+                self._live[name] = record
+            records.append(record)
+        return records
+
+    def _save(self, record: Record) -> None:
+        name: str = record.name.get_value()
+        birthday: datetime.date | None = record.bd.get_value()
+        values: tuple = (name.casefold(), record.email.get_value(), birthday.isoformat() if birthday else None,
+                         birthday.month * 100 + birthday.day if birthday else None, record.status.get_value(),
+                         record.note.get_value(), '\n'.join(text.lower() for text in record.keywords()), name)
+        if self._db.execute('UPDATE contacts SET name_folded = ?, email = ?, birthday = ?, bd_key = ?, status = ?, '
+                            'note = ?, keywords = ? WHERE name = ?', values).rowcount:
+            contact_id: int = self._db.execute('SELECT id FROM contacts WHERE name = ?', (name,)).fetchone()[0]
+            self._db.execute('DELETE FROM phones WHERE contact_id = ?', (contact_id,))
+        else:
+            contact_id = self._db.execute('INSERT INTO contacts (name_folded, email, birthday, bd_key, status, note, '
+                                          'keywords, name) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', values).lastrowid
+        self._db.executemany('INSERT INTO phones (contact_id, number, key, suffix) VALUES (?, ?, ?, ?)',
+                             [(contact_id, number, phone_key(number), phone_key(number)[-PHONE_SUFFIX:])
+                              for number in record.phone.get_value()])
+        record._book = self
+        self._live[name] = record
+        self._commit()
+
+    def _commit(self) -> None:
+        if not self._batch_depth:
+            self._db.commit()
+
+    def __getitem__(self, name: str) -> Record:
+        rows: list = self._db.execute(f'SELECT {COLUMNS} FROM contacts WHERE name = ?', (name,)).fetchall()
+        if not rows:
+            raise KeyError(name)
+        return self._records(rows)[0]
+
+    def __setitem__(self, name: str, record: Record) -> None:
+        self._save(record)
+
+    def __delitem__(self, name: str) -> None:
+        if not self._db.execute('DELETE FROM contacts WHERE name = ?', (name,)).rowcount:
+            raise KeyError(name)
+        self._detach(name)
+        self._commit()
+
+    def _detach(self, name: str) -> None:
+        record: Record | None = self._live.pop(name, None)
+        if record is not None:
+            record._book = None
+
+    def __contains__(self, name: object) -> bool:
+        return self._db.execute('SELECT 1 FROM contacts WHERE name = ?', (name,)).fetchone() is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return (name for name, in self._db.execute('SELECT name FROM contacts ORDER BY id').fetchall())
+
+    def __len__(self) -> int:
+        return self._db.execute('SELECT COUNT(*) FROM contacts').fetchone()[0]
+
+    def clear(self) -> None:
+        self._db.execute('DELETE FROM contacts')
+        for name in list(self._live):
+            self._detach(name)
+        self._commit()
+
+    def record_changed(self, record: Record, field_name: str, old_value: Any) -> None:
+        new_name: str = record.name.get_value()
+        if field_name == 'name' and old_value != new_name:
+            if new_name in self:
+                record._book = None
+                record.name.set_value(old_value)
+                record._book = self
+                raise RecordExistException(new_name)
+            self._db.execute('DELETE FROM contacts WHERE name = ?', (old_value,))
+            self._live.pop(old_value, None)
+        elif field_name == 'phone':
+            taken: list = self._conflicts(record.name.get_value(), record.phone.get_value())
+            if taken:
+                # the old numbers are still in the database, only the record needs them back
+                record.phone.get_value()[:] = old_value
+                raise PhoneExistException(taken[0])
+        self._save(record)
+
+    def _conflicts(self, name: str, numbers: List[str]) -> List[str]:
+        return [number for number in numbers
+                if self._db.execute('SELECT 1 FROM phones JOIN contacts ON contacts.id = phones.contact_id '
+                                    'WHERE phones.key = ? AND contacts.name != ? LIMIT 1',
+                                    (phone_key(number), name)).fetchone()]
+
+    def touch(self, name: str) -> None:
+        self._commit()
+
+    def flush(self) -> None:
+        self._db.commit()
+
+    @contextmanager
+    def batch(self) -> Iterator['SQLiteAddressBook']:
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self._db.commit()
+
+    def add_record(self, record: Record) -> None:
+        if record.name.get_value() in self:
+            raise RecordExistException(record.name.get_value())
+        taken: list = self._conflicts(record.name.get_value(), record.phone.get_value())
+        if taken:
+            raise PhoneExistException(taken[0])
+        self._save(record)
+
+    def delete_record(self, name: str) -> None:
+        name = self.search_by_name(name)
+        del self[name]
+
+    def iterator(self, page: int, cursor: str | None = None) -> Iterator[List[Record]]:
+        while True:
+            if cursor is None:
+                rows: list = self._db.execute(f'SELECT {COLUMNS} FROM contacts ORDER BY name_folded, name LIMIT ?',
+                                              (page,)).fetchall()
+            else:
+                rows = self._db.execute(f'SELECT {COLUMNS} FROM contacts WHERE (name_folded, name) > (?, ?) '
+                                        f'ORDER BY name_folded, name LIMIT ?',
+                                        (cursor.casefold(), cursor, page)).fetchall()
+            if not rows:
+                break
+            yield self._records(rows)
+            cursor = rows[-1][1]
+
+    def search_by_keyword(self, parameter: str) -> List[Record]:
+        if is_pattern(parameter):
+            # LIKE on the literal parts of the pattern leaves the regex only the rows that can match
+            literals: list = required_literals(parameter)
+            conditions: str = ''.join("keywords LIKE ? ESCAPE '\\' AND " for _ in literals)
+            rows: list = self._db.execute(f'SELECT {COLUMNS} FROM contacts WHERE {conditions}'
+                                          f'keywords_match(keywords, ?) ORDER BY id',
+                                          [f'%{_like(literal)}%' for literal in literals] + [parameter]).fetchall()
+        else:
+            rows = self._db.execute(f"SELECT {COLUMNS} FROM contacts WHERE keywords LIKE ? ESCAPE '\\' ORDER BY id",
+                                    (f'%{_like(parameter.lower())}%',)).fetchall()
+        if not rows:
+            raise SearchException(parameter)
+        return self._records(rows)
+
+    def search_by_name(self, name: str) -> str:
+        folded: str = name.casefold()
+        for query, arguments in (('name = ?', (name,)),
+                                 ("name_folded >= ? AND name_folded < ? ORDER BY name_folded, name",
+                                  (folded, folded + '\U0010ffff'))):
+            row: tuple | None = self._db.execute(f'SELECT name FROM contacts WHERE {query} LIMIT 1',
+                                                 arguments).fetchone()
+            if row:
+                return row[0]
+        if is_pattern(name):
+            row = self._db.execute('SELECT name FROM contacts WHERE keywords_match(name, ?) ORDER BY id LIMIT 1',
+                                   (name,)).fetchone()
+        else:
+            row = self._db.execute("SELECT name FROM contacts WHERE name_folded LIKE ? ESCAPE '\\' ORDER BY id LIMIT 1",
+                                   (f'%{_like(folded)}%',)).fetchone()
+        if row:
+            return row[0]
+        raise NameNotExistException(name)
+
+    def search_by_phone(self, number: str) -> List[Record]:
+        # the same matching as PhoneIndex.search: the whole number first, then the end of a number as typed
+        rows: list = self._db.execute(f'SELECT {COLUMNS} FROM contacts WHERE id IN '
+                                      f'(SELECT contact_id FROM phones WHERE key = ?) ORDER BY id',
+                                      (phone_key(number),)).fetchall()
+        digits: str = phone_digits(number)
+        if not rows and len(digits) >= PHONE_SUFFIX:
+            rows = self._db.execute(f'SELECT {COLUMNS} FROM contacts WHERE id IN '
+                                    f'(SELECT contact_id FROM phones WHERE suffix = ? AND key LIKE ?) ORDER BY id',
+                                    (digits[-PHONE_SUFFIX:], f'%{digits}')).fetchall()
+        if not rows:
+            raise SearchException(number)
+        return self._records(rows)
+
+    def filter(self, status: str = None, domain: str = None, month: int = None) -> List[Record]:
+        conditions: list = []
+        arguments: list = []
+        if status is not None:
+            conditions.append('status = ?')
+            arguments.append(status)
+        if domain is not None:
+            conditions.append("email LIKE ? ESCAPE '\\'")
+            arguments.append(f'%@{_like(domain)}')
+        if month is not None:
+            conditions.append('bd_key BETWEEN ? AND ?')
+            arguments += [month * 100, month * 100 + 31]
+        if not conditions:
+            raise SearchException('an empty filter')
+        rows: list = self._db.execute(f'SELECT {COLUMNS} FROM contacts WHERE {" AND ".join(conditions)} ORDER BY id',
+                                      arguments).fetchall()
+        if not rows:
+            raise SearchException(', '.join(str(value) for value in (status, domain, month) if value is not None))
+        return self._records(rows)
+
+    def upcoming_birthdays(self, days: int, today: datetime.date = None) -> List[tuple]:
+        today = today or datetime.date.today()
+        last_day: datetime.date = today + datetime.timedelta(days=min(days, 366))
+        start, end = today.month * 100 + today.day, last_day.month * 100 + last_day.day
+        if (last_day.month, last_day.day) == (2, 28) and not calendar.isleap(last_day.year):
+            end = 229
+        if days >= 365:
+            condition, arguments = 'bd_key IS NOT NULL', ()
+        elif start <= end:
+            condition, arguments = 'bd_key BETWEEN ? AND ?', (start, end)
+        else:
+            condition, arguments = 'bd_key >= ? OR bd_key <= ?', (start, end)
+        rows: list = self._db.execute(f'SELECT {COLUMNS} FROM contacts WHERE {condition}', arguments).fetchall()
+        res: list = []
+        for record in self._records(rows):
+            birth_date: datetime.date = record.bd.get_value()
+            days_left: int = (next_birthday(birth_date.month, birth_date.day, today) - today).days
+            if days_left <= days:
+                res.append((days_left, record))
+        return sorted(res, key=lambda item: item[0])
@@ -0,0 +1,382 @@
+import heapq
+import mmap
+import os
+import pickle
+import struct
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from collections.abc import MutableMapping
+from itertools import islice
+from typing import Dict, Iterator, List
+
+from classes import AddressBook, Record
+from exceptions_address_book import SnapshotCorruptedException
+from record_codec import encode_record, decode_record
+
+MAGIC = b'ABK4'
+HEADER = struct.Struct('<4sQQQII')    # magic, number of records, table offset, generation, table crc32, header crc32
+JOURNAL_MAGIC = b'ABJ1'
+JOURNAL_HEADER = struct.Struct('<4sQ')  # magic and the generation of the snapshot the journal continues
+ENTRY = struct.Struct('<QIQII')    # name offset, name length, record offset, record length, crc32 of name + record
+FRAME = struct.Struct('<II')       # length and crc32 of one journal entry
+PUT, DELETE = b'P', b'D'           # first byte of a journal entry, followed by an encoded record or a name
+
+
+def pack_header(count: int, table_offset: int, table_crc: int, generation: int) -> bytes:
+    head: bytes = HEADER.pack(MAGIC, count, table_offset, generation, table_crc, 0)[:-4]
+    return head + struct.pack('<I', zlib.crc32(head))
+
+
+def fsync_directory(path: str) -> None:
+    # makes a rename inside the directory durable; not supported (and not needed) on Windows
+    if os.name != 'nt':
+        descriptor: int = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
+
+
+def name_key(name: str) -> tuple:
+    return name.casefold(), name
+
+
+class Storage(ABC):
+    @abstractmethod
+    def load(self, book: AddressBook = None) -> AddressBook:
+        raise NotImplementedError
+
+    @abstractmethod
+    def save(self, book: AddressBook) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def write(self, changes: Dict[str, Record | None], book: AddressBook) -> None:
+        raise NotImplementedError
+
+
+class SnapshotView(MutableMapping):
+    # read-only mmap view of a snapshot: only the header is read on open, records are decoded
+    # on first access and cached; changes replayed from the journal are kept in an overlay
+    def __init__(self, path: str) -> None:
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER.size:
+            self.close()
+            raise SnapshotCorruptedException(path)
+        magic, self._count, self._table, self.generation, table_crc, header_crc = HEADER.unpack_from(self._map, 0)
+        table_end: int = self._table + self._count * ENTRY.size
+        if magic != MAGIC or header_crc != zlib.crc32(self._map[:HEADER.size - 4]) \
+                or table_end > len(self._map) or table_crc != zlib.crc32(self._map[self._table: table_end]):
+            self.close()
+            raise SnapshotCorruptedException(path)
+        self._cache: dict = {}
+        self._overlay: dict = {}
+        self._size: int = self._count
+
+    def close(self) -> None:
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self) -> 'SnapshotView':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _entry(self, position: int) -> tuple:
+        return ENTRY.unpack_from(self._map, self._table + position * ENTRY.size)
+
+    def _name(self, position: int) -> str:
+        name_offset, name_length, _, _, _ = self._entry(position)
+        return self._map[name_offset: name_offset + name_length].decode('utf-8')
+
+    def _position(self, name: str) -> int:
+        key: tuple = name_key(name)
+        low, high = 0, self._count
+        while low < high:
+            middle: int = (low + high) // 2
+            if name_key(self._name(middle)) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _in_file(self, name: str) -> bool:
+        position: int = self._position(name)
+        return position < self._count and self._name(position) == name
+
+    def _record(self, name: str, position: int) -> Record:
+        if name not in self._cache:
+            name_offset, _, record_offset, record_length, crc = self._entry(position)
+            if zlib.crc32(self._map[name_offset: record_offset + record_length]) != crc:
+                raise SnapshotCorruptedException(name)
+            self._cache[name] = decode_record(self._map[record_offset: record_offset + record_length])
+        return self._cache[name]
+
+    def __getitem__(self, name: str) -> Record:
+        if name in self._overlay:
+            if self._overlay[name] is None:
+                raise KeyError(name)
+            return self._overlay[name]
+        if name not in self._cache:
+            position: int = self._position(name)
+            if position >= self._count or self._name(position) != name:
+                raise KeyError(name)
+            return self._record(name, position)
+        return self._cache[name]
+
+    def __setitem__(self, name: str, record: Record) -> None:
+        if name not in self:
+            self._size += 1
+        self._overlay[name] = record
+
+    def __delitem__(self, name: str) -> None:
+        if name not in self:
+            raise KeyError(name)
+        self._size -= 1
+        self._overlay[name] = None
+
+    def __contains__(self, name: object) -> bool:
+        if name in self._overlay:
+            return self._overlay[name] is not None
+        return isinstance(name, str) and self._in_file(name)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[str]:
+        return (name for name, _ in self._scan(None))
+
+    def _scan(self, cursor: str | None) -> Iterator[tuple]:
+        # names after the cursor in order, each with its position in the file or -1 if it is only in the overlay
+        start: int = 0
+        added: list = sorted((name for name, record in self._overlay.items() if record is not None), key=name_key)
+        if cursor is not None:
+            start = self._position(cursor)
+            if start < self._count and self._name(start) == cursor:
+                start += 1
+            added = [name for name in added if name_key(name) > name_key(cursor)]
+        in_file: Iterator[tuple] = ((self._name(i), i) for i in range(start, self._count))
+        previous: str | None = None
+        for name, position in heapq.merge(in_file, ((name, -1) for name in added), key=lambda item: name_key(item[0])):
+            if name != previous and self._overlay.get(name, True) is not None:
+                yield name, position
+            previous = name
+
+    def iterator(self, page: int, cursor: str | None = None) -> Iterator[List[Record]]:
+        # records are read at the positions the scan reached, without a binary search per name
+        items: Iterator[tuple] = self._scan(cursor)
+        while True:
+            chunk: list = list(islice(items, page))
+            if not chunk:
+                break
+            yield [self._overlay[name] if name in self._overlay else self._record(name, position)
+                   for name, position in chunk]
+
+
+class JournalStorage(Storage):
+    # a snapshot of the whole book plus an append-only journal of per-record changes;
+    # the snapshot is rewritten only on save() or when the journal grows past compact_every entries.
+    # Every snapshot carries a generation and the journal starts with the generation it continues,
+    # so a journal left over from an earlier snapshot is never replayed on top of a newer one
+    def __init__(self, snapshot_path: str = 'contacts.bin', journal_path: str = 'contacts.journal',
+                 compact_every: int = 1000) -> None:
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.compact_every = compact_every
+        self.entries: int = 0
+        self.generation: int = 0
+        self.synced: tuple | None = None
+
+    def _state(self) -> tuple:
+        # what the files looked like when a book was last brought in line with them
+        try:
+            snapshot: os.stat_result | None = os.stat(self.snapshot_path)
+        except FileNotFoundError:
+            snapshot = None
+        stamp: tuple | None = (snapshot.st_ino, snapshot.st_mtime_ns, snapshot.st_size) if snapshot else None
+        return stamp, os.path.getsize(self.journal_path) if os.path.exists(self.journal_path) else 0
+
+    def open(self) -> SnapshotView | AddressBook:
+        if not os.path.exists(self.snapshot_path) and not os.path.exists(self.journal_path):
+            raise FileNotFoundError(self.snapshot_path)
+        contacts_view: SnapshotView | AddressBook = AddressBook()
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'rb') as fr:
+                is_snapshot: bool = fr.read(len(MAGIC)) == MAGIC
+                if not is_snapshot:
+                    # the pickle of the whole book the address book used to be saved as; it is read
+                    # once and the next save replaces it with a snapshot
+                    fr.seek(0)
+                    contacts_view = pickle.load(fr)
+            if is_snapshot:
+                contacts_view = SnapshotView(self.snapshot_path)
+        self.generation = contacts_view.generation if isinstance(contacts_view, SnapshotView) else 0
+        self.entries = self._replay(contacts_view)
+        return contacts_view
+
+    def load(self, book: AddressBook = None) -> AddressBook:
+        # the live book holds every record decoded, as commands need all of them (phone ownership, names);
+        # only paging through the snapshot with open() stays lazy. The costly indexes are built on first use
+        book = AddressBook() if book is None else book
+        book.clear()
+        try:
+            contacts_view: SnapshotView | AddressBook = self.open()
+            if isinstance(contacts_view, AddressBook):
+                for name, record in contacts_view.data.items():
+                    book[name] = record
+            else:
+                with contacts_view:
+                    for records in contacts_view.iterator(1000):
+                        for record in records:
+                            book[record.name.get_value()] = record
+        except SnapshotCorruptedException:
+            # keep the damaged file for recovery instead of letting the next save overwrite it
+            os.replace(self.snapshot_path, self.snapshot_path + '.damaged')
+            raise
+        self.synced = self._state()
+        return book
+
+    def sync(self, book: AddressBook) -> bool:
+        # brings a book loaded earlier up to date without reloading it: nothing to do if the files
+        # are as it left them, only the new journal entries to apply if just the journal grew
+        if self.synced is None:
+            return False
+        state: tuple = self._state()
+        if state == self.synced:
+            return True
+        if state[0] != self.synced[0] or state[1] < self.synced[1]:
+            return False
+        self.entries += self._replay(book, self.synced[1])
+        self.synced = self._state()
+        return True
+
+    def _snapshot_generation(self) -> int:
+        try:
+            with SnapshotView(self.snapshot_path) as contacts_view:
+                return contacts_view.generation
+        except (OSError, ValueError, SnapshotCorruptedException):
+            # no snapshot yet, or a whole-book pickle written by older versions
+            return 0
+
+    def save(self, book: AddressBook) -> None:
+        # the new snapshot is written next to the old one and renamed over it only once it is on disk,
+        # so a crash at any point leaves either the old or the new snapshot intact; the new snapshot
+        # gets the next generation, which makes the old journal stale even if it is never truncated
+        generation: int = max(self.generation, self._snapshot_generation()) + 1
+        table: list = []
+        temporary_path: str = self.snapshot_path + '.tmp'
+        with open(temporary_path, 'wb') as fw:
+            fw.write(pack_header(0, 0, 0, generation))
+            for name in sorted(book.data, key=name_key):
+                encoded_name: bytes = name.encode('utf-8')
+                encoded_record: bytes = encode_record(book.data[name])
+                table.append(ENTRY.pack(fw.tell(), len(encoded_name), fw.tell() + len(encoded_name),
+                                        len(encoded_record), zlib.crc32(encoded_record, zlib.crc32(encoded_name))))
+                fw.write(encoded_name)
+                fw.write(encoded_record)
+            table_offset: int = fw.tell()
+            encoded_table: bytes = b''.join(table)
+            fw.write(encoded_table)
+            fw.seek(0)
+            fw.write(pack_header(len(table), table_offset, zlib.crc32(encoded_table), generation))
+            fw.flush()
+            os.fsync(fw.fileno())
+        os.replace(temporary_path, self.snapshot_path)
+        fsync_directory(self.snapshot_path)
+        self.generation = generation
+        with open(self.journal_path, 'wb') as fw:
+            fw.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, generation))
+            fw.flush()
+            os.fsync(fw.fileno())
+        self.entries = 0
+        self.synced = self._state()
+
+    def write(self, changes: Dict[str, Record | None], book: AddressBook) -> None:
+        if self.entries + len(changes) >= self.compact_every:
+            self.save(book)
+            return
+        frames: list = []
+        for name, record in changes.items():
+            entry: bytes = PUT + encode_record(record) if record is not None else DELETE + name.encode('utf-8')
+            frames.append(FRAME.pack(len(entry), zlib.crc32(entry)) + entry)
+        in_sync: bool = self.synced is not None and self._state() == self.synced
+        with open(self.journal_path, 'ab') as fa:
+            if not fa.tell():
+                frames.insert(0, JOURNAL_HEADER.pack(JOURNAL_MAGIC, self.generation))
+            fa.write(b''.join(frames))
+            fa.flush()
+            os.fsync(fa.fileno())
+        self.entries += len(changes)
+        if in_sync:
+            self.synced = self._state()
+
+    @staticmethod
+    def _decode_entry(entry: bytes) -> tuple | None:
+        if entry[:1] == PUT:
+            record: Record = decode_record(entry[1:])
+            return 'put', record.name.get_value(), record
+        if entry[:1] == DELETE:
+            return 'delete', entry[1:].decode('utf-8'), None
+        # an entry of a kind this version does not know is skipped, as record_codec skips unknown fields
+        return None
+
+    def _replay(self, book: SnapshotView | AddressBook, start: int = 0) -> int:
+        if not os.path.exists(self.journal_path):
+            return 0
+        count: int = 0
+        with open(self.journal_path, 'r+b') as fr:
+            head: bytes = fr.read(JOURNAL_HEADER.size)
+            if len(head) < JOURNAL_HEADER.size or JOURNAL_HEADER.unpack(head) != (JOURNAL_MAGIC, self.generation):
+                # empty, or left behind by a save that crashed before truncating it - the snapshot already has
+                # these changes, and later entries must not be appended after them
+                fr.truncate(0)
+                return 0
+            fr.seek(max(start, JOURNAL_HEADER.size))
+            while True:
+                position: int = fr.tell()
+                frame: bytes = fr.read(FRAME.size)
+                length, crc = FRAME.unpack(frame) if len(frame) == FRAME.size else (0, None)
+                entry: bytes = fr.read(length)
+                if len(entry) != length or zlib.crc32(entry) != crc:
+                    # a torn entry left by an interrupted write - drop it so new entries stay readable
+                    fr.truncate(position)
+                    break
+                decoded: tuple | None = self._decode_entry(entry)
+                if decoded is None:
+                    continue
+                operation, name, record = decoded
+                if operation == 'put':
+                    book[name] = record
+                else:
+                    book.pop(name, None)
+                count += 1
+        return count
+
+
+class DebouncedFlusher:
+    # collects the changes made within `delay` seconds after the first one into a single storage write
+    def __init__(self, delay: float = 1.0) -> None:
+        self.delay = delay
+        self._timer: threading.Timer | None = None
+        self._lock = threading.Lock()
+
+    def schedule(self, book: AddressBook) -> None:
+        with self._lock:
+            if self._timer is None:
+                self._timer = threading.Timer(self.delay, self._fire, (book,))
+                self._timer.daemon = True
+                self._timer.start()
+
+    def cancel(self) -> None:
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def _fire(self, book: AddressBook) -> None:
+        with self._lock:
+            self._timer = None
+        book.flush()
@@ -0,0 +1,74 @@
+import re
+import unittest
+
+from classes import AddressBook, Record, Name, Phone, Email
+from indexes import FuzzyNameIndex, required_literals
+
+
+class RequiredLiteralsTest(unittest.TestCase):
+    def test_literal_runs(self) -> None:
+        cases: dict = {
+            r'gmail\.com': ['gmail.com'],
+            r'@ukr\.net$': ['@ukr.net'],
+            r'^\+38050': ['+38050'],
+            r'050.*4567': ['050', '4567'],
+            r'\bgmail\b': ['gmail'],
+            r'a\.b\.c': ['a.b.c'],
+            r'(?i)ANNA': ['anna'],
+        }
+        for pattern, literals in cases.items():
+            self.assertEqual(required_literals(pattern), literals, pattern)
+
+    def test_optional_parts_are_left_out(self) -> None:
+        cases: dict = {
+            r'colou?r': ['colo'],
+            r'abc*?def': ['def'],
+            r'ab{2}cde': ['cde'],
+            r'ab{0,3}cde': ['cde'],
+            r'(abc|def)xyz': ['xyz'],
+            r'(gmail)?\.com': ['.com'],
+            r'[abc]def': ['def'],
+            r'[]abc]def': ['def'],
+            r'\x41bcd': ['bcd'],
+            r'\N{LATIN SMALL LETTER A}bcd': ['bcd'],
+            r'(a)\1bcd': ['bcd'],
+        }
+        for pattern, literals in cases.items():
+            self.assertEqual(required_literals(pattern), literals, pattern)
+
+    def test_no_literals(self) -> None:
+        for pattern in (r'abc|def', r'gmail|ukr\.net', r'(?x)a b c d', r'.*', r'\d{3}-\d{2}', r'ab+cd'):
+            self.assertEqual(required_literals(pattern), [], pattern)
+
+    def test_pattern_search_matches_full_scan(self) -> None:
+        book = AddressBook()
+        for i, domain in enumerate(['gmail.com', 'ukr.net', 'meta.ua', 'bigmir.net'] * 25):
+            name: str = f'Contact{i}'
+            book[name] = Record(Name(name), Phone(f'050{i:07}'), Email(f'user{i}@{domain}'))
+        for pattern in (r'@ukr\.net$', r'gmail\.com', r'^\+3805000001', r'user1(0|1)2', r'Contact1[0-9]9',
+                        r'(ukr|meta)\.(ua|net)', r'(?i)CONTACT2.', r'bigmir\.net|meta', r'user\d+@me'):
+            expected: list = [record for record in book.data.values()
+                              if any(re.search(pattern, text, flags=re.I) for text in record.keywords())]
+            self.assertEqual(book._search_by_pattern(pattern), expected, pattern)
+
+
+class FuzzyNameIndexTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.index = FuzzyNameIndex(max_candidates=50)
+        for i in range(300):
+            first: str = ['Oleksandr', 'Olena', 'Iryna', 'Petro'][i % 4]
+            last: str = ['Shevchenko', 'Petrenko', 'Koval'][i % 3]
+            self.index.add(f'{first} {last} {i}', None)
+
+    def test_best_match_survives_the_cap(self) -> None:
+        self.assertEqual(self.index.search('Olexandr Shevchenko 12', 1)[0][1], 'Oleksandr Shevchenko 12')
+        self.assertEqual(self.index.search('iryna kova 290', 1)[0][1], 'Iryna Koval 290')
+
+    def test_removed_names_are_not_found(self) -> None:
+        self.index.discard('Petro Koval 299')
+        self.assertNotIn('Petro Koval 299', [name for _, name in self.index.search('Petro Koval 299')])
+        self.assertEqual(self.index.search('zzzz'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from classes import AddressBook, Record, Name, Phone
+from storage import JournalStorage
+
+
+class JournalStorageTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory: str = tempfile.mkdtemp()
+        self.storage = JournalStorage(os.path.join(self.directory, 'contacts.bin'),
+                                      os.path.join(self.directory, 'contacts.journal'))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def test_journal_replayed_after_snapshot(self) -> None:
+        book = AddressBook()
+        book['Anna'] = Record(Name('Anna'), Phone('0501234567'))
+        self.storage.save(book)
+        book['Bill'] = Record(Name('Bill'), Phone('0671234567'))
+        self.storage.write({'Anna': None, 'Bill': book['Bill']}, book)
+        self.assertEqual(list(self.storage.load().data), ['Bill'])
+
+    def test_stale_journal_ignored_after_crash_in_save(self) -> None:
+        book = AddressBook()
+        book['Anna'] = Record(Name('Anna'), Phone('0501234567'))
+        self.storage.save(book)
+        self.storage.write({'Anna': None}, book)
+        with open(self.storage.journal_path, 'rb') as fr:
+            stale_journal: bytes = fr.read()
+        self.storage.save(book)
+        # the crash: the new snapshot is in place but the journal was never truncated
+        with open(self.storage.journal_path, 'wb') as fw:
+            fw.write(stale_journal)
+        loaded: AddressBook = JournalStorage(self.storage.snapshot_path, self.storage.journal_path).load()
+        self.assertEqual(list(loaded.data), ['Anna'])
+        # entries written after the crash continue the new snapshot, not the stale journal
+        self.storage.load(loaded)
+        loaded['Bill'] = Record(Name('Bill'), Phone('0671234567'))
+        self.storage.write({'Bill': loaded['Bill']}, loaded)
+        self.assertEqual(sorted(self.storage.load().data), ['Anna', 'Bill'])
+
+
+if __name__ == '__main__':
+    unittest.main()
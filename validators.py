@@ -0,0 +1,88 @@
+import datetime
+import re
+from functools import lru_cache
+from typing import Any, Callable, Iterable, List, Tuple
+
+from exceptions_address_book import *
+
+UKR_MOBILE_PHONE_CODES = ['095', '099', '050', '063', '066', '067', '077', '0800', '045', '046', '032',
+                          '044', '048', '068', '097', '098', '091', '092', '094', ]
+PHONE_CODES = frozenset(UKR_MOBILE_PHONE_CODES)
+PHONE_CODE_LENGTHS = tuple(sorted({len(code) for code in UKR_MOBILE_PHONE_CODES}))
+STATUSES = ('Friend', 'Family', 'Co-Worker', 'Special', None)
+
+PHONE_SEPARATORS = re.compile(r'[+\-() ]')
+PHONE_PATTERN = re.compile(r'[0-9]{7,15}')
+# the same language as ([a-zA-Z.]+\w+\.?)+(@\w{2,}\.)(\w{2,}) without the nested quantifier,
+# which backtracks exponentially on long invalid addresses
+EMAIL_PATTERN = re.compile(r'[a-zA-Z.][\w.]*\w\.?@\w{2,}\.\w{2,}')
+
+
+def check_name(name: str) -> str:
+    if name and isinstance(name, str) and len(name) > 1:
+        return name
+    raise NameNotFilledException
+
+
+def check_phone(phone_num: str) -> str | None:
+    if phone_num:
+        phone_num = PHONE_SEPARATORS.sub('', phone_num)
+        if not PHONE_PATTERN.fullmatch(phone_num):
+            raise ValidPhoneException(phone_num)
+        for length in PHONE_CODE_LENGTHS:
+            if phone_num[:length] in PHONE_CODES:
+                return f'+38{phone_num}'
+    return None
+
+
+def check_email(email: str) -> str | None:
+    if not email:
+        return None
+    if EMAIL_PATTERN.match(email):
+        return email
+    raise ValidEmailException(email)
+
+
+@lru_cache(maxsize=4096)
+def _parse_birthday(birthday: str) -> datetime.date:
+    if len(birthday) == 10 and birthday[4] == birthday[7] == '-':
+        try:
+            return datetime.date.fromisoformat(birthday)
+        except ValueError:
+            pass
+    try:
+        year, month, day = birthday.split('-')
+    except ValueError:
+        raise ValidBirthDateException(birthday)
+    try:
+        return datetime.date(int(year), int(month), int(day))
+    except ValueError:
+        raise ValidBirthDateFormatException(birthday)
+
+
+def check_birthday(birthday: str) -> datetime.date | None:
+    if not birthday:
+        return None
+    return _parse_birthday(birthday.strip())
+
+
+def check_status(status: str) -> str:
+    if status in STATUSES:
+        return status
+    raise StatusNotExistException(status)
+
+
+VALIDATORS = {'name': check_name, 'phone': check_phone, 'email': check_email,
+              'bd': check_birthday, 'status': check_status}
+
+
+def validate_many(field_name: str, values: Iterable[str]) -> List[Tuple[Any, Exception | None]]:
+    check: Callable = VALIDATORS[field_name]
+    res: list = []
+    append: Callable = res.append
+    for value in values:
+        try:
+            append((check(value), None))
+        except Exception as error:
+            append((None, error))
+    return res